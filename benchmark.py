@@ -0,0 +1,385 @@
+import argparse
+import csv
+import hashlib
+import json
+import openpyxl
+import os
+import random
+import sys
+import time
+
+from document import Document, PDFTranscriptDocumentSet, SFMExtractDocumentSet, EmailExtractDocumentSet
+import tokenizer
+import vopd
+
+# Words that are neither subjects nor keywords, to pad out the synthetic texts
+FILLER_WORDS = ['the', 'a', 'of', 'and', 'to', 'in', 'is', 'that', 'it', 'was', 'for', 'on', 'are', 'with',
+                'they', 'this', 'have', 'from', 'one', 'had', 'by', 'word', 'but', 'not', 'what', 'all',
+                'were', 'we', 'when', 'your', 'can', 'said', 'there', 'use', 'an', 'each', 'which', 'she',
+                'do', 'how', 'their', 'if', 'will', 'up', 'other', 'about', 'out', 'many', 'then', 'them',
+                'tonight', 'news', 'show', 'today', 'people', 'week', 'country', '.', ',', '?', '!']
+
+
+def read_rows(filepath):
+    with open(filepath) as csv_file:
+        return list(csv.reader(csv_file))
+
+
+def scale_keyword_rows(keyword_rows, lexicon_scale):
+    """ The keyword rows, plus (lexicon_scale - 1) made-up variants of each keyword """
+    scaled_rows = list(keyword_rows)
+    for variant in range(1, lexicon_scale):
+        for keyword, keyword_code, keyword_id in keyword_rows:
+            scaled_rows.append(['{}{}'.format(keyword, variant), keyword_code, '{}-{}'.format(keyword_id, variant)])
+    return scaled_rows
+
+
+def synthetic_text(rng, lexicon_words, min_words, max_words, lexicon_rate=0.1):
+    words = []
+    for _ in range(rng.randint(min_words, max_words)):
+        if rng.random() < lexicon_rate:
+            words.append(rng.choice(lexicon_words))
+        else:
+            words.append(rng.choice(FILLER_WORDS))
+    return ' '.join(words)
+
+
+def write_table(filepath, header, rows):
+    """ Write rows to an .xlsx (streaming, so large corpora fit in memory) or .csv file """
+    if filepath.endswith('.xlsx'):
+        workbook = openpyxl.Workbook(write_only=True)
+        worksheet = workbook.create_sheet()
+        worksheet.append(header)
+        for row in rows:
+            worksheet.append(row)
+        workbook.save(filepath)
+    else:
+        with open(filepath, 'w', newline='') as csv_file:
+            table_csv = csv.writer(csv_file)
+            table_csv.writerow(header)
+            table_csv.writerows(rows)
+
+
+def generate_tweets(filepath, count, lexicon_words, seed):
+    """ An SFM-style tweet extract with count tweets """
+    rng = random.Random(seed)
+    tweet_types = ['original', 'retweet', 'quote', 'reply']
+
+    def tweet_rows():
+        for n in range(count):
+            tweet_id = str(1000000000000000000 + n)
+            user_screen_name = 'user{}'.format(rng.randint(1, 500))
+            created_at = 'Fri Jun 01 {:02d}:{:02d}:{:02d} +0000 2018'.format(rng.randint(0, 23), rng.randint(0, 59),
+                                                                              rng.randint(0, 59))
+            yield [tweet_id, 'https://twitter.com/{}/status/{}'.format(user_screen_name, tweet_id), created_at,
+                   user_screen_name, rng.choice(tweet_types), synthetic_text(rng, lexicon_words, 5, 50)]
+
+    write_table(filepath, list(SFMExtractDocumentSet.COLUMNS), tweet_rows())
+
+
+def generate_emails(filepath, count, lexicon_words, seed):
+    """ An email extract with count emails """
+    rng = random.Random(seed)
+
+    def email_rows():
+        for n in range(count):
+            yield ['2018-06-01 {:02d}:{:02d}:00'.format(n // 60 % 24, n % 60), 'sender{}@example.com'.format(n),
+                   'Subject {}'.format(n), synthetic_text(rng, lexicon_words, 50, 300)]
+
+    write_table(filepath, list(EmailExtractDocumentSet.COLUMNS), email_rows())
+
+
+def digest(values):
+    """ Digest of benchmark output, to detect changes in what is extracted or matched """
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def best_time(function, repeat):
+    """ Best of repeat timings of function(), and its result """
+    best_seconds = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - start
+        if best_seconds is None or seconds < best_seconds:
+            best_seconds = seconds
+    return best_seconds, result
+
+
+class Benchmarks:
+    """ Runs benchmarks, collecting each one's throughput and output digest """
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = {}
+
+
+    def run(self, name, function, amount, unit):
+        """ Time function(), which processes amount units and returns its output """
+        seconds, output = best_time(function, self.repeat)
+        self.results[name] = {'seconds': seconds,
+                              'throughput': amount / seconds if seconds else 0.0,
+                              'unit': unit + '/s',
+                              'digest': digest(output)}
+        print('{:40} {:12.1f} {:12} ({:.3f}s)'.format(name, self.results[name]['throughput'], self.results[name]['unit'],
+                                                      seconds))
+        return output
+
+
+    def compare(self, baseline, tolerance):
+        """ Problems compared to baseline: throughput more than tolerance below it, or different output """
+        problems = []
+        for name, result in sorted(self.results.items()):
+            if name not in baseline:
+                continue
+            baseline_result = baseline[name]
+            if result['digest'] != baseline_result['digest']:
+                problems.append('{}: output differs from the baseline'.format(name))
+            minimum_throughput = baseline_result['throughput'] * (1 - tolerance)
+            if result['throughput'] < minimum_throughput:
+                problems.append('{}: {:.1f} {} is below the baseline {:.1f} {} by more than {:.0%}'.format(
+                    name, result['throughput'], result['unit'], baseline_result['throughput'],
+                    baseline_result['unit'], tolerance))
+        return problems
+
+
+def match_all(documents, words_list, window_size, context_size, engine):
+    results = []
+    for document, document_words in zip(documents, words_list):
+        matches = list(vopd.match_engines[engine](document_words, window_size=window_size))
+        results.append([document.metadata.get('show_file_path', ''), matches])
+    return results
+
+
+def check_tokenizer(name, texts, args):
+    """ Compare the regex tokenizer with nltk's word_tokenize on texts; problems if any tokens differ """
+    tokenizer_name = args.tokenizer
+    vopd.use_tokenizer('nltk', args.nltk_data)
+    different_tokens = 0
+    different_matches = 0
+    example = None
+    for text in texts:
+        clean_document_text = vopd.clean_text(text)
+        nltk_words = vopd.word_tokenize(clean_document_text)
+        regex_words = tokenizer.word_tokenize(clean_document_text)
+        if regex_words == nltk_words:
+            continue
+        different_tokens += 1
+        if (list(vopd.process_document_iter_indexed(regex_words, args.window))
+                != list(vopd.process_document_iter_indexed(nltk_words, args.window))):
+            different_matches += 1
+        if example is None:
+            position = next((i for i, (regex_word, nltk_word) in enumerate(zip(regex_words, nltk_words))
+                             if regex_word != nltk_word), min(len(regex_words), len(nltk_words)))
+            example = 'nltk {} / regex {}'.format(nltk_words[max(0, position - 3):position + 3],
+                                                  regex_words[max(0, position - 3):position + 3])
+    vopd.use_tokenizer(tokenizer_name, args.nltk_data)
+
+    print('{:40} {} of {} documents tokenized differently by the regex tokenizer, {} with different matches'.format(
+        name + '-check-tokenizer', different_tokens, len(texts), different_matches))
+    if different_tokens:
+        return ['{}: the regex tokenizer differs from nltk on {} of {} documents ({} with different matches), e.g. {}'.format(
+            name, different_tokens, len(texts), different_matches, example)]
+    return []
+
+
+def benchmark_transcripts(benchmarks, transcripts_path, engines, lexicon_scales, rows, args):
+    problems = []
+    transcript_filepaths = PDFTranscriptDocumentSet(transcripts_path).transcript_filepaths
+    pdf_filepaths = [os.path.relpath(filepath, transcripts_path) for filepath in transcript_filepaths]
+    pdf_bytes = sum(os.path.getsize(filepath) for filepath in transcript_filepaths)
+
+    texts = None
+    for extractor in args.pdf_extractors:
+        pdfdocset = PDFTranscriptDocumentSet(transcripts_path, extractor=extractor)
+        extractor_texts = benchmarks.run('pdf-extract-{}'.format(extractor),
+                                         lambda: [pdfdocset.document(filepath).text
+                                                  for filepath in pdfdocset.transcript_filepaths],
+                                         pdf_bytes / 1024 / 1024, 'MB')
+        if texts is None:
+            texts = extractor_texts
+        elif extractor_texts != texts:
+            problems.append('pdf-extract-{}: the text differs from the {} extractor'.format(extractor,
+                                                                                        args.pdf_extractors[0]))
+    documents = [Document(text=text, metadata={'show_file_path': filepath})
+                 for text, filepath in zip(texts, pdf_filepaths)]
+    words_list = benchmarks.run('pdf-tokenize', lambda: [vopd.tokenize(text) for text in texts],
+                                sum(map(len, texts)) / 1024 / 1024, 'MB')
+    tokens = sum(map(len, words_list))
+
+    for lexicon_scale in lexicon_scales:
+        vopd.load_lexicon(rows['subjects'], scale_keyword_rows(rows['keywords'], lexicon_scale), rows['normalize'])
+        for engine in engines:
+            benchmarks.run('pdf-match-{}-lexicon-x{}'.format(engine, lexicon_scale),
+                           lambda: match_all(documents, words_list, args.window, args.context, engine),
+                           tokens, 'tokens')
+    vopd.load_lexicon(rows['subjects'], rows['keywords'], rows['normalize'])
+
+    # Tokenizing and matching a page at a time (--stream-pages) must give the same matches as the whole text
+    page_texts = [[page + '\x0c' for page in text.split('\x0c')[:-1]] for text in texts]
+    page_matches = benchmarks.run('pdf-tokenize-match-pages',
+                                  lambda: [vopd.match_document_pages(document.metadata, pages, args.window,
+                                                                     args.context)[1]
+                                           for document, pages in zip(documents, page_texts)],
+                                  sum(map(len, texts)) / 1024 / 1024, 'MB')
+    if page_matches != [vopd.match_document(document, args.window, args.context)[1] for document in documents]:
+        problems.append('pdf-tokenize-match-pages: the matches differ from those of the whole text')
+
+    if args.check_tokenizer:
+        problems += check_tokenizer('pdf', texts, args)
+    return problems
+
+
+def benchmark_lexicon(benchmarks, lexicon_scales, rows, args):
+    """ Building the lexicon from its rows, and loading it compiled, at each lexicon scale; both must give the same tables """
+    problems = []
+    compiled_dir = os.path.join(args.workdir, 'compiled-lexicon')
+    for lexicon_scale in lexicon_scales:
+        lexicon_rows = (rows['subjects'], scale_keyword_rows(rows['keywords'], lexicon_scale), rows['normalize'])
+        entries = sum(map(len, lexicon_rows))
+
+        def lexicon_summary():
+            return [len(vopd.subject_index), len(vopd.keyword_index), len(vopd.token_ids), vopd.normalize_pattern.pattern]
+
+        built = benchmarks.run('lexicon-build-x{}'.format(lexicon_scale),
+                               lambda: vopd.load_lexicon(*lexicon_rows) or lexicon_summary(), entries, 'entries')
+        vopd.load_lexicon_compiled(lexicon_rows, compiled_dir, recompile=True)
+        loaded = benchmarks.run('lexicon-load-compiled-x{}'.format(lexicon_scale),
+                                lambda: vopd.load_lexicon_compiled(lexicon_rows, compiled_dir) or lexicon_summary(),
+                                entries, 'entries')
+        if loaded != built:
+            problems.append('lexicon-load-compiled-x{}: the lexicon differs from the one built'.format(lexicon_scale))
+    vopd.load_lexicon(rows['subjects'], rows['keywords'], rows['normalize'])
+    return problems
+
+
+def benchmark_tweets(benchmarks, tweets_filepath, count, args):
+    def read_tweets():
+        return [[tweet.text, tweet.metadata] for tweet in SFMExtractDocumentSet(tweets_filepath)]
+
+    def match_tweets():
+        return [[tweet_info, matches] for tweet_info, matches, document_stats
+                in (vopd.match_tweet(tweet, args.window, args.context) for tweet in SFMExtractDocumentSet(tweets_filepath))]
+
+    def match_tweets_batch():
+        results = []
+        for tweets in SFMExtractDocumentSet(tweets_filepath, chunk_size=args.batch_size).document_chunks():
+            results.extend([tweet_info, matches] for tweet_info, matches, document_stats
+                           in vopd.match_tweets_batch(tweets, args.window, args.context))
+        return results
+
+    name = 'tweets-{}'.format(count)
+    tweets = benchmarks.run(name + '-read', read_tweets, count, 'docs')
+    problems = []
+    if args.check_tokenizer:
+        problems += check_tokenizer(name, [text for text, tweet_info in tweets], args)
+    per_tweet_results = benchmarks.run(name + '-match', match_tweets, count, 'docs')
+    batch_results = benchmarks.run(name + '-match-batch', match_tweets_batch, count, 'docs')
+    if batch_results != per_tweet_results:
+        problems.append('{}-match-batch: output differs from {}-match'.format(name, name))
+    return problems
+
+
+def benchmark_emails(benchmarks, emails_filepath, count, args):
+    def read_emails():
+        return [[email.text, email.metadata] for email in EmailExtractDocumentSet(emails_filepath)]
+
+    def match_emails():
+        return [[email_info, matches] for email_info, matches, document_stats
+                in (vopd.match_document(email, args.window, args.context) for email in EmailExtractDocumentSet(emails_filepath))]
+
+    name = 'emails-{}'.format(count)
+    emails = benchmarks.run(name + '-read', read_emails, count, 'docs')
+    problems = []
+    if args.check_tokenizer:
+        problems += check_tokenizer(name, [text for text, email_info in emails], args)
+    benchmarks.run(name + '-match', match_emails, count, 'docs')
+    return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark extraction, tokenization and matching, '
+                                                 'and check for regressions against a saved baseline')
+    parser.add_argument('--transcripts', help='directory of transcript PDFs (default = test_transcripts)', type=str,
+                        default='test_transcripts')
+    parser.add_argument('--tweets', help='sizes of synthetic tweet extracts to benchmark (default = 10000)', type=int,
+                        nargs='*', default=[10000])
+    parser.add_argument('--emails', help='sizes of synthetic email extracts to benchmark (default = 10000)', type=int,
+                        nargs='*', default=[10000])
+    parser.add_argument('--format', help='file format of synthetic extracts: xlsx or csv (default = xlsx)',
+                        choices=['xlsx', 'csv'], default='xlsx')
+    parser.add_argument('--pdf-extractors', help='PDF text extractors to benchmark (default = fast pdfminer)',
+                        choices=['fast', 'pdfminer'], nargs='+', default=['fast', 'pdfminer'])
+    parser.add_argument('--lexicon-scales', help='multiples of keywords.csv to benchmark matching with (default = 1 4)',
+                        type=int, nargs='*', default=[1, 4])
+    parser.add_argument('--engines', help='matching engines to benchmark (default = indexed)',
+                        choices=sorted(vopd.match_engines), nargs='*', default=['indexed'])
+    parser.add_argument('--window', help='matching window (default = 10)', type=int, default=10)
+    parser.add_argument('--context', help='matching context (default = 20)', type=int, default=20)
+    parser.add_argument('--batch-size', help='tweets per chunk for batch matching (default = 1000)', type=int,
+                        default=1000)
+    parser.add_argument('--tokenizer', help='word tokenizer to benchmark: nltk or regex (default = nltk)',
+                        choices=['nltk', 'regex'], default='nltk')
+    parser.add_argument('--nltk-data', help='directory containing nltk data (the punkt tokenizer)', type=str)
+    parser.add_argument('--check-tokenizer', help='also check that the regex tokenizer gives the same words as nltk\'s '
+                                                  'word_tokenize on every document', action='store_true')
+    parser.add_argument('--repeat', help='times to run each benchmark, keeping the best (default = 3)', type=int,
+                        default=3)
+    parser.add_argument('--seed', help='random seed for the synthetic extracts (default = 1)', type=int, default=1)
+    parser.add_argument('--workdir', help='directory for the synthetic extracts (default = benchmark-data)', type=str,
+                        default='benchmark-data')
+    parser.add_argument('--baseline', help='baseline results file (default = benchmark-baseline.json)', type=str,
+                        default='benchmark-baseline.json')
+    parser.add_argument('--save-baseline', help='save these results as the new baseline', action='store_true')
+    parser.add_argument('--tolerance', help='fraction of baseline throughput a benchmark may lose before failing '
+                                            '(default = 0.2)', type=float, default=0.2)
+    parser.add_argument('--results', help='also write these results to this JSON file', type=str)
+
+    args = parser.parse_args()
+
+    rows = {'subjects': read_rows('subjects.csv'),
+            'keywords': read_rows('keywords.csv'),
+            'normalize': read_rows('normalize_terms.csv')}
+    vopd.load_lexicon(rows['subjects'], rows['keywords'], rows['normalize'])
+    vopd.use_tokenizer(args.tokenizer, args.nltk_data)
+    lexicon_words = vopd.subjects + vopd.keywords + list(vopd.normalize_terms)
+
+    benchmarks = Benchmarks(args.repeat)
+    problems = []
+    if args.transcripts:
+        problems += benchmark_transcripts(benchmarks, args.transcripts, args.engines, args.lexicon_scales, rows, args)
+
+    os.makedirs(args.workdir, exist_ok=True)
+    problems += benchmark_lexicon(benchmarks, args.lexicon_scales, rows, args)
+    for count in args.tweets:
+        tweets_filepath = os.path.join(args.workdir, 'tweets-{}-{}.{}'.format(count, args.seed, args.format))
+        if not os.path.exists(tweets_filepath):
+            generate_tweets(tweets_filepath, count, lexicon_words, args.seed)
+        problems += benchmark_tweets(benchmarks, tweets_filepath, count, args)
+    for count in args.emails:
+        emails_filepath = os.path.join(args.workdir, 'emails-{}-{}.{}'.format(count, args.seed, args.format))
+        if not os.path.exists(emails_filepath):
+            generate_emails(emails_filepath, count, lexicon_words, args.seed)
+        problems += benchmark_emails(benchmarks, emails_filepath, count, args)
+
+    if args.results:
+        with open(args.results, 'w') as results_file:
+            json.dump(benchmarks.results, results_file, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as baseline_file:
+                baseline = json.load(baseline_file)
+        baseline.update(benchmarks.results)
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        print('Saved baseline to {}'.format(args.baseline))
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            problems += benchmarks.compare(json.load(baseline_file), args.tolerance)
+    else:
+        print('No baseline at {}; run with --save-baseline to create one'.format(args.baseline))
+
+    for problem in problems:
+        print('FAIL ' + problem)
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,78 @@
+import hashlib
+import os
+import pickle
+import stat
+import tempfile
+
+# A compiled lexicon: the tables vopd.load_lexicon() builds from the rows of the subjects, keywords and
+# normalize terms CSV files (the hashed indexes, codes and ids, token ids, prefix and wildcard tries, and
+# normalize terms pattern), saved in one file so that later runs, and worker processes, load them rather
+# than build them again. The CSV files are still read and hashed, each process loads its own copy, and the
+# normalize terms pattern is compiled again as it is unpickled, so this saves only a few milliseconds.
+#
+# The file is a header line, "vopd-lexicon <FORMAT_VERSION> <source hash>", followed by the pickled tables.
+# The source hash is of the rows the tables were built from, so that the lexicon is compiled again as soon
+# as one of the CSV files changes.
+#
+# Unpickling can run any code the file holds, so a compiled lexicon is only read if it, and the directory
+# it is in, belong to the user running vopd and cannot be written by anyone else. Where file owners cannot
+# be checked (Windows), it is never read, and the tables are built every time.
+
+MAGIC = b'vopd-lexicon'
+# Changed whenever the tables, or the classes in them, change, so that old files are compiled again
+FORMAT_VERSION = 3
+
+
+def source_hash(lexicon_rows, matching_rules):
+    """ Hash of the subject, keyword and normalize terms rows, and the version of the matching rules """
+    digest = hashlib.sha256(str(matching_rules).encode('utf-8'))
+    for rows in lexicon_rows:
+        # cells, rows and files are separated by ASCII unit, record and group separators, which CSV cells do not contain
+        digest.update(b'\x1d')
+        digest.update('\x1e'.join('\x1f'.join(row) for row in rows).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _header(rows_hash):
+    return b' '.join((MAGIC, str(FORMAT_VERSION).encode('ascii'), rows_hash.encode('ascii'))) + b'\n'
+
+
+def _is_private(file_stat):
+    """ Whether a file or directory belongs to the current user, and cannot be written by anyone else """
+    return file_stat.st_uid == os.getuid() and not file_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def read(filepath, rows_hash):
+    """ The tables compiled into filepath from rows with the given source hash, or None if there are none,
+    or if the file could have been written by another user """
+    if not hasattr(os, 'getuid'):
+        return None
+    header = _header(rows_hash)
+    try:
+        with open(filepath, 'rb') as lexicon_file:
+            if not (_is_private(os.fstat(lexicon_file.fileno()))
+                    and _is_private(os.stat(os.path.dirname(os.path.abspath(filepath))))):
+                return None
+            if lexicon_file.read(len(header)) != header:
+                return None
+            return pickle.load(lexicon_file)
+    except (OSError, ValueError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        # missing, empty or unreadable: compile it again
+        return None
+
+
+def write(filepath, rows_hash, tables):
+    """ Compile tables, built from rows with the given source hash, into filepath """
+    directory = os.path.dirname(filepath) or '.'
+    os.makedirs(directory, exist_ok=True)
+    # write to a temporary file first, so other processes never read a partial lexicon
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as lexicon_file:
+            lexicon_file.write(_header(rows_hash))
+            pickle.dump(tables, lexicon_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, filepath)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
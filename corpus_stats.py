@@ -0,0 +1,80 @@
+import collections
+import json
+
+
+def per_10k_words(matches, tokens):
+    """ Matches per 10,000 words, so that documents of different lengths can be compared """
+    return matches * 10000 / tokens if tokens else 0.0
+
+
+class CorpusStats:
+    """ Counts of the words and matches in the documents of a run, gathered as each document's matches are
+    written, so that reports on them need not read the extracts back.
+
+    Documents are counted in total, by date and, for transcripts, by show. The severity histograms count
+    extract rows by keyword code, and the cross-tab counts them by subject code and keyword code; a merged
+    extract (--merge-extracts) counts once for each pair of the subject and keyword codes listed in it.
+    """
+    def __init__(self, mode, keep_documents=False):
+        """ keep_documents keeps each document's counts for the summary, e.g. to compare transcripts """
+        self.mode = mode
+        self.keep_documents = keep_documents
+        self.total = self._new_group()
+        self.dates = collections.defaultdict(self._new_group)
+        self.shows = collections.defaultdict(self._new_group)
+        self.code_pairs = collections.defaultdict(collections.Counter)
+        self.document_counts = []
+
+
+    @staticmethod
+    def _new_group():
+        return {'documents': 0, 'tokens': 0, 'matches': 0, 'severity': collections.Counter()}
+
+
+    def add_document(self, document_name, date, tokens, matches, code_pairs, show=None):
+        """ Count a document: its date, its number of tokens and matches, and the (subject code, keyword code)
+        pairs of its extract rows; show is the show a transcript is of """
+        groups = [self.total, self.dates[date]]
+        if show is not None:
+            groups.append(self.shows[show])
+        for group in groups:
+            group['documents'] += 1
+            group['tokens'] += tokens
+            group['matches'] += matches
+        for subject_code, keyword_code in code_pairs:
+            self.code_pairs[subject_code][keyword_code] += 1
+            for group in groups:
+                group['severity'][keyword_code] += 1
+        if self.keep_documents:
+            document_counts = {'document': document_name, 'date': date}
+            if show is not None:
+                document_counts['show'] = show
+            document_counts.update(tokens=tokens, matches=matches, matches_per_10k_words=per_10k_words(matches, tokens))
+            self.document_counts.append(document_counts)
+
+
+    @staticmethod
+    def _group_summary(group):
+        return {'documents': group['documents'],
+                'tokens': group['tokens'],
+                'matches': group['matches'],
+                'matches_per_10k_words': per_10k_words(group['matches'], group['tokens']),
+                'severity': dict(sorted(group['severity'].items()))}
+
+
+    def summary(self):
+        summary = {'mode': self.mode}
+        summary.update(self._group_summary(self.total))
+        summary['subject_keyword_codes'] = {subject_code: dict(sorted(keyword_counts.items()))
+                                            for subject_code, keyword_counts in sorted(self.code_pairs.items())}
+        summary['by_date'] = {date: self._group_summary(group) for date, group in sorted(self.dates.items())}
+        if self.shows:
+            summary['by_show'] = {show: self._group_summary(group) for show, group in sorted(self.shows.items())}
+        if self.keep_documents:
+            summary['per_document'] = self.document_counts
+        return summary
+
+
+    def write(self, stats_filepath):
+        with open(stats_filepath, 'w') as stats_file:
+            json.dump(self.summary(), stats_file, indent=2)
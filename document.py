@@ -1,8 +1,18 @@
+import csv
+import glob
+import gzip
+import hashlib
 import io
+import itertools
+import json
 import os
-import pandas as pd
-import sys
-from pdfminer.high_level import extract_text_to_fp
+import tempfile
+
+# pdfminer and openpyxl are slow to import, so they are only imported when reading PDF and .xlsx files
+
+class InputFileError(ValueError):
+    """ A transcript, SFM or email extract file, or directory of them, that cannot be read """
+
 
 class DocumentSet:
     def __init__(self):
@@ -18,49 +28,220 @@ class Document:
         self.metadata = metadata
 
 
+# Characters of a cached text read at a time
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class ExtractedTextCache:
+    """ On-disk cache of text extracted from PDF files.
+
+    Entries are gzip-compressed and named by a hash of the PDF's contents plus the extractor's
+    version and settings, so a changed file or extractor never hits a stale entry.
+    When the cache grows beyond max_bytes, the least recently used entries are removed.
+    """
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+
+    def key(self, pdf_bytes, extractor):
+        digest = hashlib.sha256(pdf_bytes)
+        digest.update(extractor.encode('utf-8'))
+        return digest.hexdigest()
+
+
+    def get_pages(self, key):
+        """ Return an iterator over the pages of the cached text for key, each ending with a form feed,
+        or None. The entry is read a block at a time, so only about a page of it is held at once; it can
+        still turn out to be damaged part way, raising OSError or EOFError. """
+        entry_path = self._entry_path(key)
+        try:
+            entry_file = gzip.open(entry_path, 'rt', encoding='utf-8')
+            # mark as recently used
+            os.utime(entry_path)
+        except OSError:
+            return None
+        return self._read_pages(entry_file)
+
+
+    @staticmethod
+    def _read_pages(entry_file):
+        with entry_file:
+            page = ''
+            for block in iter(lambda: entry_file.read(READ_BLOCK_SIZE), ''):
+                pages = (page + block).split('\x0c')
+                for complete_page in pages[:-1]:
+                    yield complete_page + '\x0c'
+                page = pages[-1]
+            if page:
+                yield page
+
+
+    def put(self, key, text):
+        for page in self.put_pages(key, [text]):
+            pass
+
+
+    def put_pages(self, key, pages):
+        """ Yield each of pages, while writing them to the cache as the text for key.
+        The entry is only added once the last page has been written. """
+        temp_path = None
+        entry_file = None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # write to a temporary file first, so other processes never read a partial entry
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            os.close(fd)
+            entry_file = gzip.open(temp_path, 'wt', encoding='utf-8')
+        except OSError:
+            # the cache is only an optimization; carry on without it
+            pass
+        writing = entry_file is not None
+        complete = False
+        try:
+            for page in pages:
+                if writing:
+                    try:
+                        entry_file.write(page)
+                    except OSError:
+                        writing = False
+                yield page
+            complete = writing
+        finally:
+            # also when extraction fails, or not all pages are read
+            self._finish_entry(key, temp_path, entry_file, complete)
+
+
+    def _finish_entry(self, key, temp_path, entry_file, complete):
+        """ Add a completely written temporary file to the cache, or remove it """
+        try:
+            if entry_file is not None:
+                entry_file.close()
+            if complete:
+                os.replace(temp_path, self._entry_path(key))
+                self._evict()
+                return
+        except OSError:
+            pass
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+    def clear(self):
+        for entry_path in self._entry_paths():
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + '.txt.gz')
+
+
+    def _entry_paths(self):
+        if not os.path.isdir(self.cache_dir):
+            return []
+        return [os.path.join(self.cache_dir, filename) for filename in os.listdir(self.cache_dir)
+                if filename.endswith('.txt.gz')]
+
+
+    def _evict(self):
+        """ Remove least recently used entries until the cache fits in max_bytes """
+        entries = []
+        for entry_path in self._entry_paths():
+            try:
+                entry_stat = os.stat(entry_path)
+            except FileNotFoundError:
+                continue
+            entries.append((entry_stat.st_mtime, entry_stat.st_size, entry_path))
+        total_bytes = sum(size for mtime, size, entry_path in entries)
+        for mtime, size, entry_path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+
 class PDFTranscriptDocumentSet(DocumentSet):
-    def __init__(self, transcripts_filepath):
+    def __init__(self, transcripts_filepath, text_cache=None, extractor='fast'):
+        """ extractor is one of pdftext.EXTRACTORS """
         self.filepath = transcripts_filepath
+        self.text_cache = text_cache
+        self.extractor = extractor
 
         # Compose self.transcript_filepaths list
         if not os.path.exists(transcripts_filepath):
-            print('{} does not exist'.format(transcripts_filepath))
-            sys.exit(1)
+            raise InputFileError('{} does not exist'.format(transcripts_filepath))
         self.transcript_filepaths = []
         if os.path.isdir(transcripts_filepath):
             for filename in os.listdir(transcripts_filepath):
                 filepath = os.path.join(transcripts_filepath, filename)
                 if os.path.isfile(filepath) and filename.lower().endswith('.pdf'):
                     self.transcript_filepaths.append(filepath)
+            # process a directory in a stable (file name) order
+            self.transcript_filepaths.sort()
         else:
             self.transcript_filepaths.append(transcripts_filepath)
 
         # finally, make it an iterable
-        self.transcript_filepaths = iter(self.transcript_filepaths)
+        self.transcript_filepaths_iter = iter(self.transcript_filepaths)
 
 
     def __next__(self):
         """ Iterator to yield Document, where each Transcript is a Document """
 
         # get the path to the next file
-        pdfFile = self.transcript_filepaths.__next__()
+        pdfFile = self.transcript_filepaths_iter.__next__()
+        return self.document(pdfFile)
+
+
+    def document(self, pdf_filepath):
+        """ Extract a single transcript as a Document; may be called from worker processes """
         # extract the text
-        text = self._extract_text(pdfFile)
-        md = self._show_data(pdfFile)
+        text = ''.join(self.page_texts(pdf_filepath))
+        md = self.show_data(pdf_filepath)
         doc = Document(text=text, metadata=md)
 
         return doc
 
 
-    def _extract_text(self, pdf_filepath):
-        """ Internal utility function to extract text from a single PDF file """
+    def page_texts(self, pdf_filepath):
+        """ Iterator over the text of each page of a single PDF file, each ending with a form feed;
+        the pages are only extracted as they are read """
+        import pdftext
+
         with open(pdf_filepath, "rb") as fp:
-            text_fp = io.StringIO()
-            extract_text_to_fp(fp, text_fp)
-            return text_fp.getvalue()
+            pdf_bytes = fp.read()
+
+        if self.text_cache is None:
+            return pdftext.page_texts(io.BytesIO(pdf_bytes), self.extractor)
+
+        cache_key = self.text_cache.key(pdf_bytes, pdftext.extractor_version(self.extractor))
+        cached_pages = self.text_cache.get_pages(cache_key)
+        if cached_pages is not None:
+            return self._cached_page_texts(cache_key, cached_pages, pdf_bytes)
+        return self.text_cache.put_pages(cache_key, pdftext.page_texts(io.BytesIO(pdf_bytes), self.extractor))
+
+
+    def _cached_page_texts(self, cache_key, cached_pages, pdf_bytes):
+        import pdftext
+
+        pages_read = 0
+        try:
+            for page in cached_pages:
+                yield page
+                pages_read += 1
+        except (OSError, EOFError):
+            # a damaged entry; extract the text again, replacing the entry, and carry on after the pages read
+            yield from itertools.islice(self.text_cache.put_pages(
+                cache_key, pdftext.page_texts(io.BytesIO(pdf_bytes), self.extractor)), pages_read, None)
 
 
-    def _show_data(self, show_file_path):
+    def show_data(self, show_file_path):
         show_file_name = os.path.split(show_file_path)[1]
 
         show_info = {}
@@ -75,57 +256,186 @@ class PDFTranscriptDocumentSet(DocumentSet):
         return show_info
 
 
+def _cell_text(value):
+    """ Render a spreadsheet cell as text, as pd.read_excel(dtype=str, keep_default_na=False) would """
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _sfm_json_row(tweet):
+    """ Flatten a tweet from an SFM JSON export into the columns of SFM's tabular exports """
+    if 'tweet_url' in tweet:
+        # already flattened
+        return tweet
+    user_screen_name = tweet['user']['screen_name']
+    if 'retweeted_status' in tweet:
+        tweet_type = 'retweet'
+    elif 'quoted_status' in tweet:
+        tweet_type = 'quote'
+    elif tweet.get('in_reply_to_status_id_str'):
+        tweet_type = 'reply'
+    else:
+        tweet_type = 'original'
+    text = tweet.get('extended_tweet', {}).get('full_text') or tweet.get('full_text') or tweet.get('text', '')
+    return {'id': tweet['id_str'],
+            'tweet_url': 'https://twitter.com/{}/status/{}'.format(user_screen_name, tweet['id_str']),
+            'created_at': tweet['created_at'],
+            'user_screen_name': user_screen_name,
+            'tweet_type': tweet_type,
+            'text': text}
+
+
+def _table_rows(table_filepath):
+    """ Stream the rows of an .xlsx, .csv or JSON lines file; the first row yielded is the header """
+    extension = os.path.splitext(table_filepath)[1].lower()
+    if extension == '.xlsx':
+        import openpyxl
+        workbook = openpyxl.load_workbook(table_filepath, read_only=True)
+        try:
+            for row in workbook.worksheets[0].iter_rows(values_only=True):
+                yield tuple(_cell_text(value) for value in row)
+        finally:
+            workbook.close()
+    elif extension == '.csv':
+        with open(table_filepath, newline='', encoding='utf-8-sig') as table_file:
+            yield from csv.reader(table_file)
+    elif extension in ('.json', '.jsonl'):
+        header = None
+        with open(table_filepath, encoding='utf-8') as table_file:
+            for line in table_file:
+                if not line.strip():
+                    continue
+                record = _sfm_json_row(json.loads(line))
+                if header is None:
+                    header = tuple(record)
+                    yield header
+                yield tuple(_cell_text(record.get(column)) for column in header)
+    else:
+        raise InputFileError('{} is not an .xlsx, .csv or .json file'.format(table_filepath))
+
+
+def table_filepaths(path, extensions):
+    """ The files path names: a single file, the files in a directory with one of extensions, or the files
+    matching a glob pattern (e.g. "exports/tweets-2019-*.csv"); in file name order """
+    if os.path.isdir(path):
+        filepaths = [os.path.join(path, filename) for filename in os.listdir(path)
+                     if filename.lower().endswith(extensions) and os.path.isfile(os.path.join(path, filename))]
+    elif os.path.exists(path) or not any(character in path for character in '*?['):
+        return [path]
+    else:
+        filepaths = [filepath for filepath in glob.glob(path) if os.path.isfile(filepath)]
+    if not filepaths:
+        raise InputFileError('{} names no {} files'.format(path, ' or '.join(extensions)))
+    return sorted(filepaths)
+
+
+def read_table_chunks(table_filepath, columns, chunk_size=1000):
+    """ Stream the given columns of a table file as lists of at most chunk_size tuples,
+    so memory use does not depend on the size of the file """
+    if not os.path.exists(table_filepath):
+        raise InputFileError('{} does not exist'.format(table_filepath))
+    rows = _table_rows(table_filepath)
+    header = next(rows, ())
+    missing_columns = [column for column in columns if column not in header]
+    if missing_columns:
+        raise InputFileError('{} is missing columns: {}'.format(table_filepath, ', '.join(missing_columns)))
+    column_indexes = [header.index(column) for column in columns]
+
+    chunk = []
+    for row in rows:
+        # rows may be ragged, e.g. in csv files
+        chunk.append(tuple(row[index] if index < len(row) else '' for index in column_indexes))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
 class SFMExtractDocumentSet(DocumentSet):
-    def __init__(self, sfmfilepath):
-        """ Initialize with the path to a (single) SFM extract Excel file"""
-        # must be an .xlsx file!
-        df = pd.read_excel(sfmfilepath, dtype=str, keep_default_na=False)
-        self.df_iterrows = df.iterrows()
+    COLUMNS = ('id', 'tweet_url', 'created_at', 'user_screen_name', 'tweet_type', 'text')
+    EXTENSIONS = ('.xlsx', '.csv', '.json', '.jsonl')
+
+    def __init__(self, sfmfilepath, chunk_size=1000):
+        """ Initialize with the path to an SFM extract .xlsx, .csv or JSON lines file, or to a directory of them,
+        or a glob pattern matching them; the files are read one after another, in file name order """
+        self.filepaths = table_filepaths(sfmfilepath, self.EXTENSIONS)
+        self.chunks = itertools.chain.from_iterable(read_table_chunks(filepath, self.COLUMNS, chunk_size)
+                                                    for filepath in self.filepaths)
+        self.rows = itertools.chain.from_iterable(self.chunks)
 
 
     def __next__(self):
         """ Iterator to yield Documents, where each Tweet is a Document """
 
-        index, line = self.df_iterrows.__next__()
-        text = line['text']
+        return self._document(next(self.rows))
+
+
+    def document_chunks(self):
+        """ Iterator to yield lists of Documents, one list per chunk of rows read """
+        for chunk in self.chunks:
+            yield [self._document(line) for line in chunk]
+
+
+    def _document(self, line):
+        text = line[-1]
         md = self._tweet_data(line)
         doc = Document(text=text, metadata=md)
         return doc
 
 
     def _tweet_data(self, tweet):
+        tweet_id, tweet_url, created_at, user_screen_name, tweet_type, text = tweet
         tweet_info = {}
-        tweet_info['id'] = "'"+tweet['id']+"'"
-        tweet_info['tweet_url'] = tweet['tweet_url']
-        tweet_info['created_at'] = tweet['created_at']
-        tweet_info['user_screen_name'] = tweet['user_screen_name']
-        tweet_info['tweet_type'] = tweet['tweet_type']
+        tweet_info['id'] = "'"+tweet_id+"'"
+        tweet_info['tweet_url'] = tweet_url
+        tweet_info['created_at'] = created_at
+        tweet_info['user_screen_name'] = user_screen_name
+        tweet_info['tweet_type'] = tweet_type
         return tweet_info
 
 
 class EmailExtractDocumentSet(DocumentSet):
-    def __init__(self, emailfilepath):
-        """ Initialize with the path to a (single) SFM extract Excel file"""
-        # must be an .xlsx file!
+    COLUMNS = ('Date', 'From', 'Subject', 'Message')
+    EXTENSIONS = ('.xlsx', '.csv')
 
-        df = pd.read_excel(emailfilepath, dtype=str, keep_default_na=False)
-        self.df_iterrows = df.iterrows()
+    def __init__(self, emailfilepath, chunk_size=1000):
+        """ Initialize with the path to an email extract .xlsx or .csv file, or to a directory of them,
+        or a glob pattern matching them; the files are read one after another, in file name order """
+        self.filepaths = table_filepaths(emailfilepath, self.EXTENSIONS)
+        self.chunks = itertools.chain.from_iterable(read_table_chunks(filepath, self.COLUMNS, chunk_size)
+                                                    for filepath in self.filepaths)
+        self.rows = itertools.chain.from_iterable(self.chunks)
 
 
     def __next__(self):
-        """ Iterator to yield Documents, where each Tweet is a Document """
+        """ Iterator to yield Documents, where each Email is a Document """
+
+        return self._document(next(self.rows))
+
 
-        index, line = next(self.df_iterrows)
-        text = line['Message']
+    def document_chunks(self):
+        """ Iterator to yield lists of Documents, one list per chunk of rows read """
+        for chunk in self.chunks:
+            yield [self._document(line) for line in chunk]
+
+
+    def _document(self, line):
+        text = line[-1]
         md = self._email_data(line)
         doc = Document(text=text, metadata=md)
         return doc
 
 
     def _email_data(self, email):
+        email_date, email_from, email_subject, message = email
         email_info = {}
-        email_info['Date'] = email['Date']
-        email_info['From'] = email['From']
-        email_info['Subject'] = email['Subject']
+        email_info['Date'] = email_date
+        email_info['From'] = email_from
+        email_info['Subject'] = email_subject
+        # tells apart emails with the same date, sender and subject, e.g. two without a subject sent in the same minute
+        email_info['Message hash'] = hashlib.sha256(message.encode('utf-8')).hexdigest()[:16]
         return email_info
-
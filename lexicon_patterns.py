@@ -0,0 +1,173 @@
+import re
+
+# Prefix and wildcard entries of the subject and keyword lists, matched against words with a character trie.
+#
+# An entry ending in a single hyphen after a letter, e.g. "anti-", is a prefix: it matches every word
+# starting with it ("anti-immigrant").
+# In an entry, "*", or a run of two or more hyphens (as in "bull----"), stands for one censored letter each.
+# Such an entry matches words censored at those places with any of CENSOR_MARKS, or spelled out
+# there, provided at least one letter is censored: "f**k" matches "f**k", "f*ck" and "f--k", but not "fork".
+# The tokenizers split words at most of these marks ("f--k" becomes "f", "--", "k"), so before a text is
+# tokenized, protect_censored_words() writes the marks of each censored word an entry matches as "_". Words
+# the tokenizer keeps whole are left as they are, so that a word listed as an exact entry, e.g. "bull****", is
+# still matched as that entry: nltk 3.4.5 keeps "f**k" whole, while newer versions of nltk split it at "*".
+#
+# Two entries with the same letters and censored places, e.g. "bull----" and "bull****", match the same words;
+# the one added first is reported, and the other is listed in PatternTrie.shadowed_entries.
+#
+# Every other entry is matched exactly, as before.
+
+# Characters used in place of the letters of a censored word
+CENSOR_MARKS = frozenset('*-#@$%!_')
+_CENSOR_MARK_CHARS = ''.join(sorted(CENSOR_MARKS))
+
+# A prefix entry: letters or digits, then a single hyphen
+PREFIX_ENTRY = re.compile(r'.*[^\W_]-$')
+# The censored letters of an entry
+WILDCARDS = re.compile(r'\*|-{2,}')
+# A censor mark the tokenizers split words at (any but "*", "_" and a single "-")
+SPLIT_CENSOR_MARK = re.compile(r'[#@$%!]|--')
+# The same, for tokenizers that also split words at "*", as newer versions of nltk do
+SPLIT_CENSOR_MARK_OR_STAR = re.compile(r'[*#@$%!]|--')
+# The letters and censor marks of a word, from some point in it on
+WORD_CHARS = re.compile(r'[\w*#@$%!-]*')
+# A censor mark, other than "_"
+CENSOR_MARK = re.compile(r'[*#@$%!-]')
+
+# Trie node keys, besides each literal character
+_ANY_LETTER = '*'
+_WORD_END = ''
+_PREFIX_END = None
+
+
+def is_pattern_entry(entry):
+    return bool(PREFIX_ENTRY.match(entry) or (WILDCARDS.search(entry) and WILDCARDS.sub('', entry)))
+
+
+def protect_censored_words(text, tries, split_marks=SPLIT_CENSOR_MARK):
+    """ text with the censor marks of each word that the tokenizer would split up at split_marks, and that a wildcard
+    entry of one of tries matches, written as "_", so that the word stays whole. Marks after such a word that are not part of the
+    match, e.g. in "sh*t!", are left as they are. The text keeps its length, and so the offsets of its characters. """
+    pieces = []
+    last_end = 0
+    for mark in split_marks.finditer(text):
+        if mark.start() < last_end:
+            # in the word before
+            continue
+        start = mark.start()
+        while start > last_end and (text[start - 1].isalnum() or text[start - 1] in CENSOR_MARKS):
+            start -= 1
+        end = WORD_CHARS.match(text, mark.start()).end()
+        pieces.append(text[last_end:start])
+        pieces.append(_protected_word(text[start:end], tries, split_marks))
+        last_end = end
+    if not pieces:
+        return text
+    pieces.append(text[last_end:])
+    return ''.join(pieces)
+
+
+def _protected_word(word, tries, split_marks):
+    """ word with its censor marks as "_", if an entry of one of tries then matches it, leaving out any marks
+    at its start (as in "--f**k"), and at its end one at a time, until one does; otherwise word as it is.
+    A part the tokenizer keeps whole, as "bull****" in "bull****!", is left as it is """
+    starts = [0]
+    letters_start = len(word) - len(word.lstrip(_CENSOR_MARK_CHARS))
+    if letters_start:
+        starts.append(letters_start)
+    for start in starts:
+        end = len(word)
+        while end > start:
+            if not split_marks.search(word, start, end):
+                return word
+            protected = CENSOR_MARK.sub('_', word[start:end])
+            if any(trie.match(protected) is not None for trie in tries):
+                return word[:start] + protected + word[end:]
+            if word[end - 1] not in CENSOR_MARKS:
+                break
+            end -= 1
+    return word
+
+
+def _entry_steps(entry):
+    """ The trie keys spelling out an entry: its literal characters, with _ANY_LETTER for each censored letter """
+    if PREFIX_ENTRY.match(entry):
+        return list(entry), _PREFIX_END
+    steps = []
+    position = 0
+    for wildcard in WILDCARDS.finditer(entry):
+        steps.extend(entry[position:wildcard.start()])
+        steps.extend([_ANY_LETTER] * len(wildcard.group(0)))
+        position = wildcard.end()
+    steps.extend(entry[position:])
+    return steps, _WORD_END
+
+
+class PatternTrie:
+    """ Character trie of prefix and wildcard lexicon entries.
+
+    match() finds the entry a word matches by walking the word's characters down the trie, so its cost
+    depends on the length of the word, not on the number of entries. Results are remembered, as
+    the same words come up again and again.
+    """
+    def __init__(self, entries=(), max_cached=100000):
+        self.root = {}
+        self.entries = 0
+        self.wildcard_entries = 0
+        # (entry, the entry added before it that it matches the same words as)
+        self.shadowed_entries = []
+        self.max_cached = max_cached
+        self.cache = {}
+        for entry in entries:
+            self.add(entry)
+
+
+    def add(self, entry):
+        steps, end = _entry_steps(entry)
+        node = self.root
+        for step in steps:
+            node = node.setdefault(step, {})
+        if node.get(end, entry) != entry:
+            self.shadowed_entries.append((entry, node[end]))
+        node.setdefault(end, entry)
+        self.entries += 1
+        if end is _WORD_END:
+            self.wildcard_entries += 1
+        self.cache.clear()
+
+
+    def __len__(self):
+        return self.entries
+
+
+    def match(self, word):
+        """ The entry matching word, or None. The longest matching entry wins, and a literal character over a wildcard. """
+        try:
+            return self.cache[word]
+        except KeyError:
+            pass
+        entry = self._match(self.root, word, 0, False, False)[1]
+        if len(self.cache) >= self.max_cached:
+            self.cache.clear()
+        self.cache[word] = entry
+        return entry
+
+
+    def _match(self, node, word, position, wild, censored):
+        """ (length matched, entry) of the best entry below node, for word[position:] """
+        best = (-1, None)
+        # Entries with wildcards only match censored words
+        acceptable = censored or not wild
+        if _PREFIX_END in node and acceptable:
+            best = (position, node[_PREFIX_END])
+        if position == len(word):
+            if _WORD_END in node and acceptable:
+                best = (position, node[_WORD_END])
+            return best
+        char = word[position]
+        if char != _ANY_LETTER and char in node:
+            best = max(best, self._match(node[char], word, position + 1, wild, censored), key=lambda found: found[0])
+        if _ANY_LETTER in node and (char.isalpha() or char in CENSOR_MARKS):
+            best = max(best, self._match(node[_ANY_LETTER], word, position + 1, True, censored or char in CENSOR_MARKS),
+                       key=lambda found: found[0])
+        return best
@@ -0,0 +1,70 @@
+import datetime
+import hashlib
+import pathlib
+import sqlite3
+
+
+def file_sha256(filepath):
+    """ Hash of a file's contents, read a block at a time """
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as fp:
+        for block in iter(lambda: fp.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ProcessedManifest:
+    """ Record of the documents already processed into an extracts file, kept in a small SQLite database.
+
+    Each document is identified by a key (e.g. file path plus content hash, or tweet id), and is
+    recorded together with the version of the lexicon and settings it was matched with; a document
+    counts as processed only for that same version.
+    """
+    def __init__(self, manifest_filepath, lexicon_version, output_file=None, commit_every=1000, read_only=False):
+        """ output_file, if given, is the extracts file; it is flushed before each commit, and only then,
+        so that documents are only recorded as processed once their extracts are on disk, and extracts
+        only reach the disk as their documents are recorded.
+        read_only opens an existing manifest only to look documents up, e.g. from worker processes
+        while the main process records them. """
+        self.lexicon_version = lexicon_version
+        self.output_file = output_file
+        self.commit_every = commit_every
+        self.pending = 0
+        if read_only:
+            self.connection = sqlite3.connect(pathlib.Path(manifest_filepath).absolute().as_uri() + '?mode=ro', uri=True)
+            return
+        self.connection = sqlite3.connect(manifest_filepath)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS processed ('
+                                'document_key TEXT NOT NULL, '
+                                'lexicon_version TEXT NOT NULL, '
+                                'processed_at TEXT NOT NULL, '
+                                'PRIMARY KEY (document_key, lexicon_version))')
+        self.connection.commit()
+
+
+    def is_processed(self, document_key):
+        cursor = self.connection.execute('SELECT 1 FROM processed WHERE document_key = ? AND lexicon_version = ?',
+                                         (document_key, self.lexicon_version))
+        return cursor.fetchone() is not None
+
+
+    def mark_processed(self, document_key):
+        """ Record a document as processed, once its extracts have been written """
+        self.connection.execute('INSERT OR REPLACE INTO processed VALUES (?, ?, ?)',
+                                (document_key, self.lexicon_version,
+                                 datetime.datetime.now(datetime.timezone.utc).isoformat()))
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.commit()
+
+
+    def commit(self):
+        if self.output_file is not None:
+            self.output_file.flush()
+        self.connection.commit()
+        self.pending = 0
+
+
+    def close(self):
+        self.commit()
+        self.connection.close()
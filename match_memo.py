@@ -0,0 +1,41 @@
+import collections
+import hashlib
+
+
+class MatchMemo:
+    """ Bounded cache of the matches found in document texts, so that a text seen before (e.g. a retweet,
+    or a forwarded email body) is not tokenized and matched again.
+
+    Results are looked up by a hash of the text plus the matching settings. Once the memo holds
+    max_entries results, the least recently used one is dropped for each new one.
+    """
+    def __init__(self, max_entries=50000):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+
+
+    def key(self, text, *settings):
+        return (hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest(),) + settings
+
+
+    def get(self, key):
+        """ The result remembered for key, or None """
+        result = self.entries.get(key)
+        if result is not None:
+            self.entries.move_to_end(key)
+        return result
+
+
+    def put(self, key, result):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+    def clear(self):
+        self.entries.clear()
+
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,87 @@
+import io
+
+import pdfminer
+from pdfminer.converter import TextConverter
+from pdfminer.pdfdevice import PDFTextDevice
+from pdfminer.pdffont import PDFUnicodeNotDefined
+from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+from pdfminer.pdfpage import PDFPage
+
+# Text extraction from PDF files with pdfminer, a page at a time.
+# This module imports pdfminer, which is slow to import, so document.py only imports it when reading PDFs.
+#
+# Each extractor yields the text of each page, ending with a form feed, as pdfminer's extract_text_to_fp
+# writes it (without layout analysis, which it does not do by default):
+# - pdfminer: pdfminer's TextConverter, as extract_text_to_fp uses
+# - fast: a device that keeps the text of each character as it is drawn. TextConverter also makes a
+#   layout object for each character, with its position and size, only to write out its text; skipping
+#   that halves the time extraction takes, for the same text.
+
+
+class PageTextDevice(PDFTextDevice):
+    """ Collects the text of the characters drawn on a page, in the order they are drawn """
+    def __init__(self, rsrcmgr):
+        super().__init__(rsrcmgr)
+        self.chars = []
+
+
+    def render_string(self, textstate, seq, *args):
+        # The positions of characters are not needed for their text, so unlike PDFTextDevice this
+        # does not work them out; numbers in seq only move the next character along
+        font = textstate.font
+        for obj in seq:
+            if isinstance(obj, bytes):
+                for cid in font.decode(obj):
+                    try:
+                        self.chars.append(font.to_unichr(cid))
+                    except PDFUnicodeNotDefined:
+                        # as PDFLayoutAnalyzer.handle_undefined_char
+                        self.chars.append('(cid:{})'.format(cid))
+
+
+    def page_text(self):
+        """ The text drawn since the last call, as the text of a page """
+        self.chars.append('\x0c')
+        text = ''.join(self.chars)
+        self.chars = []
+        return text
+
+
+def fast_page_texts(pdf_file):
+    rsrcmgr = PDFResourceManager(caching=True)
+    device = PageTextDevice(rsrcmgr)
+    interpreter = PDFPageInterpreter(rsrcmgr, device)
+    for page in PDFPage.get_pages(pdf_file, caching=True):
+        interpreter.process_page(page)
+        yield device.page_text()
+    device.close()
+
+
+def pdfminer_page_texts(pdf_file):
+    rsrcmgr = PDFResourceManager(caching=True)
+    text_fp = io.StringIO()
+    device = TextConverter(rsrcmgr, text_fp)
+    interpreter = PDFPageInterpreter(rsrcmgr, device)
+    for page in PDFPage.get_pages(pdf_file, caching=True):
+        interpreter.process_page(page)
+        yield text_fp.getvalue()
+        text_fp.seek(0)
+        text_fp.truncate()
+    device.close()
+
+
+EXTRACTORS = {'fast': fast_page_texts,
+              'pdfminer': pdfminer_page_texts}
+
+
+def page_texts(pdf_file, extractor='fast'):
+    """ The text of each page of a PDF file (a binary file object), with the given extractor """
+    return EXTRACTORS[extractor](pdf_file)
+
+
+def extractor_version(extractor):
+    """ Identifies the text an extractor gives, e.g. in cache keys; changes whenever pdfminer's version does """
+    if extractor == 'pdfminer':
+        # as before there was a choice of extractors, so that existing cache entries are still used
+        return 'pdfminer.six-{};extract_text_to_fp;laparams=default'.format(pdfminer.__version__)
+    return 'pdfminer.six-{};{}'.format(pdfminer.__version__, extractor)
@@ -0,0 +1,68 @@
+import collections
+import datetime
+import json
+import time
+
+
+class RunProfile:
+    """ Time spent in each stage of a run, with counts of what went through it.
+
+    Each document's stats are a dict of stage seconds (extract, tokenize, match, write) and
+    counts (tokens, matches, rows, and memo hits and misses), as returned by vopd.match_document and friends.
+    """
+    STAGES = ('extract', 'tokenize', 'match', 'write')
+    COUNTS = ('tokens', 'matches', 'rows', 'memo_hits', 'memo_misses')
+
+    def __init__(self, mode, keep_documents=False):
+        """ keep_documents keeps each document's stats for the summary, e.g. to find slow transcripts """
+        self.mode = mode
+        self.keep_documents = keep_documents
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self.started = time.perf_counter()
+        self.documents = 0
+        self.stage_seconds = collections.Counter()
+        self.counts = collections.Counter()
+        self.document_stats = []
+
+
+    def add_document(self, document_name, document_stats):
+        self.documents += 1
+        for stage in self.STAGES:
+            self.stage_seconds[stage] += document_stats.get(stage, 0.0)
+        for count in self.COUNTS:
+            self.counts[count] += document_stats.get(count, 0)
+        if self.keep_documents:
+            self.document_stats.append(dict(document=document_name, **document_stats))
+
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        summary = {'mode': self.mode,
+                   'started_at': self.started_at.isoformat(),
+                   'elapsed_seconds': elapsed,
+                   'documents': self.documents}
+        for count in self.COUNTS:
+            summary[count] = self.counts[count]
+        # With --workers, stages overlap, so their seconds can add up to more than the elapsed time
+        summary['stage_seconds'] = {stage: self.stage_seconds[stage] for stage in self.STAGES}
+        summary['documents_per_second'] = self.documents / elapsed if elapsed else 0.0
+        summary['tokens_per_second'] = self.counts['tokens'] / elapsed if elapsed else 0.0
+        if self.keep_documents:
+            summary['per_document'] = self.document_stats
+        return summary
+
+
+    def report(self):
+        """ A short, human readable summary """
+        summary = self.summary()
+        stage_report = ', '.join('{} {:.2f}s'.format(stage, seconds) for stage, seconds in summary['stage_seconds'].items())
+        report = ('{documents} documents, {tokens} tokens, {matches} matches, {rows} rows in {elapsed_seconds:.2f}s '
+                  '({documents_per_second:.1f} docs/s, {tokens_per_second:.0f} tokens/s); '.format(**summary) + stage_report)
+        if summary['memo_hits'] or summary['memo_misses']:
+            report += '; match memo {memo_hits} hits, {memo_misses} misses'.format(**summary)
+        return report
+
+
+    def write(self, summary_filepath):
+        with open(summary_filepath, 'w') as summary_file:
+            json.dump(self.summary(), summary_file, indent=2)
@@ -1,103 +1,192 @@
 import argparse
-from pdfminer.high_level import extract_text_to_fp
-import datetime
-import io
+import collections
+import csv
+import functools
+import json
+from manifest import file_sha256
+import multiprocessing
 import os
 import sys
-import csv
-import statistics
-
-# global variables
-subject_map = {}
-keyword_score = {}
-keyword_id = {}
-subjects = []
-keywords = []
 
+# Columns of the keyword, the coder's score and the coder's new keyword in each kind of coding file.
+# The coding layout of PDF extracts has them in columns H, N and Q; tweet and email extracts have one more
+# and one fewer column before the subject (6 and 4, against 5), so theirs are moved along by as much.
+CODING_COLUMNS = {'pdf': (7, 13, 16),
+                  'tweets': (8, 14, 17),
+                  'email': (6, 12, 15)}
+# The kind of coding file, told from the name of its second column (as in the extracts files)
+FORMAT_OF_HEADER = {'file': 'pdf',
+                    'tweet_id': 'tweets',
+                    'email_date': 'email'}
+# Merged extracts (vopd.py --merge-extracts) list several keywords in the keyword column
+MERGED_ENTRY_SEPARATOR = '; '
+# Changed whenever the state file's layout does, so that an old state file is not misread
+STATE_VERSION = 1
+
+
+# The coding files at each path: a CSV file itself, or the CSV files in a directory, in file name order
+def coding_filepaths(paths):
+    filepaths = []
+    for path in paths:
+        if os.path.isdir(path):
+            filepaths.extend(sorted(os.path.join(path, filename) for filename in os.listdir(path)
+                                    if filename.lower().endswith('.csv')))
+        else:
+            filepaths.append(path)
+    return filepaths
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--codingfile', help='coding/analysis file (default = coding.csv)', type=argparse.FileType('r'),
-                        default='coding.csv')
-    parser.add_argument('--keywordfile', help='keyword list file (default = keywords.csv)', type=argparse.FileType('r'),
-                        default='keywords.csv')
-    parser.add_argument('--normalizefile', help='normalize terms file (default = normalize_terms.csv)', type=argparse.FileType('r'),
-                        default='normalize_terms.csv')
-
-    args = parser.parse_args()
 
-    # Read through existing keywords file
-    with args.keywordfile as keywords_file:
-        keywords_csv = csv.reader(keywords_file)
-        for row in keywords_csv:
-            keywords += [row[0]]
-            keyword_score[row[0]] = row[1]
-            keyword_id[row[0]] = row[2]
-
-    keyword_coded = {}
-    with args.codingfile as coding_file:
+# Count the scores given to each keyword in a coding file, read a row at a time.
+# Returns the file's format and, for each keyword, a Counter of its scores in the order they first appear.
+def read_coding_file(default_format, coding_filepath):
+    keyword_counts = collections.defaultdict(collections.Counter)
+    with open(coding_filepath, newline='') as coding_file:
         coding_csv = csv.reader(coding_file)
-        next(coding_csv, None)  # Skip the header row
+        header = next(coding_csv, [])
+        file_format = FORMAT_OF_HEADER.get(header[1].strip() if len(header) > 1 else None, default_format)
+        keyword_column, score_column, new_keyword_column = CODING_COLUMNS[file_format]
 
         for row in coding_csv:
-            old_keyword = row[7]  # Column H
-            new_score = row[13]  # Column N
-            new_keyword = row[16] # Column Q
-
+            if len(row) <= score_column:
+                continue
+            new_score = row[score_column].strip()
             if not new_score.isnumeric():
                 # do nothing, go to the next line
                 continue
+            new_keyword = row[new_keyword_column].strip() if len(row) > new_keyword_column else ''
 
-
-            if new_keyword.strip() is not '':
-                # keep in mind that the new keyword may or may not already exist in keywords
-                if new_keyword in keyword_coded:
-                    # if we've already seen it in this coding file
-                    print("Updating new keyword ", new_keyword)
-                    keyword_coded[new_keyword] += [int(new_score)]
-                else:
-                    print("Adding new keyword ", new_keyword)
-                    keyword_coded[new_keyword] = [int(new_score)]
+            # keep in mind that the new keyword may or may not already exist in keywords
+            if new_keyword != '':
+                keyword_counts[new_keyword][int(new_score)] += 1
             else:
                 # we have seen cases where there's nothing in either H or Q; just skip this
-                if old_keyword.strip() is '':
-                    continue
-                if old_keyword in keyword_coded:
-                    # if we've already seen it in this coding file
-                    print("There's no new keyword; Updating old keyword ", old_keyword)
-                    keyword_coded[old_keyword] += [int(new_score)]
-                else:
-                    print("There's no new keyword; Adding old keyword ", old_keyword)
-                    keyword_coded[old_keyword] = [int(new_score)]
-
-    keyword_mode_scores = {}
-    for k, s in keyword_coded.items():
-        try:
-            keyword_mode_scores[k] = statistics.mode(s)
-        except statistics.StatisticsError:
-            m = round(statistics.mean(s))
-            print("Where keyword =", k, " and scores =", s)
-            print("Made a decision to go with ", m)
-            keyword_mode_scores[k] = m
-
-    # Now merge with keywords file
-    keywords_new = keywords
-    keyword_score_new = keyword_score
-    keyword_id_new = keyword_id
-
-    for k, s in keyword_mode_scores.items():
-        if k in keywords:
-            keyword_score_new[k] = keyword_mode_scores[k]
-            keyword_id_new[k] = keyword_id[k]
-        else:
-            keywords_new += [k]
-            keyword_score_new[k] = keyword_mode_scores[k]
-            keyword_id_new[k] = ''
+                for old_keyword in row[keyword_column].split(MERGED_ENTRY_SEPARATOR):
+                    if old_keyword.strip() != '':
+                        keyword_counts[old_keyword][int(new_score)] += 1
+    return file_format, keyword_counts
 
-    with open('keywords_new.csv', 'w') as new_keyword_file:
-        keywords_new_csv = csv.writer(new_keyword_file)
 
-        for k in keywords_new:
-            keywords_new_csv.writerow([k, keyword_id_new[k], keyword_score_new[k]])
+# The state carried from one run to the next (with --state): for each coding file counted, by absolute path, its
+# content hash and the scores it gives each keyword. A file is only read again if it changes, and then its old counts
+# are replaced rather than added to. Without a state file, the state starts empty and is not kept.
+def load_state(state_filepath):
+    if state_filepath is None or not os.path.exists(state_filepath):
+        return {'version': STATE_VERSION, 'coding_files': {}}
+    with open(state_filepath) as state_file:
+        state = json.load(state_file)
+    if state.get('version') != STATE_VERSION:
+        sys.exit('{} was written by a different version of recycle_keywords.py; '
+                 'delete it to count all coding files again'.format(state_filepath))
+    return state
 
 
+def save_state(state, state_filepath):
+    # Written to a new file first, so that an interrupted run leaves the old state as it was
+    temp_filepath = state_filepath + '.tmp'
+    with open(temp_filepath, 'w') as state_file:
+        json.dump(state, state_file)
+    os.replace(temp_filepath, state_filepath)
+
+
+# The scores counted for each keyword over all the coding files in the state, in the order the files were counted
+def total_keyword_scores(state):
+    keyword_scores = collections.defaultdict(collections.Counter)
+    for coding_file in state['coding_files'].values():
+        for keyword, score_counts in coding_file['keyword_scores'].items():
+            keyword_scores[keyword].update(score_counts)
+    return keyword_scores
+
+
+# The mode of a keyword's scores: the most common score, the one counted first on a tie (as statistics.mode)
+def mode_score(score_counts):
+    return max(score_counts, key=lambda score: score_counts[score])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('codingfiles', help='coding/analysis files, or directories of them (default = coding.csv)',
+                        nargs='*')
+    parser.add_argument('--codingfile', help='a coding/analysis file, or directory of them, as for codingfiles; '
+                                             'may be given more than once', action='append', default=[])
+    parser.add_argument('--format', help='layout of coding files whose header does not tell: pdf, tweets or email '
+                                         '(default = pdf)', choices=sorted(CODING_COLUMNS), default='pdf')
+    parser.add_argument('--keywordfile', help='keyword list file (default = keywords.csv)', type=argparse.FileType('r'),
+                        default='keywords.csv')
+    parser.add_argument('--normalizefile', help='normalize terms file (default = normalize_terms.csv)', type=argparse.FileType('r'),
+                        default='normalize_terms.csv')
+    parser.add_argument('--state', help='file keeping the scores counted so far, so that later runs given it only read new coding '
+                                        'files, and add them to the scores of all those counted before (default = none: only '
+                                        'the coding files given are counted)', type=str)
+    parser.add_argument('--workers', help='number of processes reading coding files (default = 1)', type=int, default=1)
+    parser.add_argument("--verbose", help="increase output verbosity",
+                        action="store_true")
+
+    args = parser.parse_args()
+
+    # Read through existing keywords file
+    with args.keywordfile as keywords_file:
+        keyword_rows = list(csv.reader(keywords_file))
+
+    state = load_state(args.state)
+    run_filepaths = coding_filepaths(args.codingfiles + args.codingfile or ['coding.csv'])
+    # Say which files counted in earlier runs go into the scores, besides those given this time
+    run_abspaths = {os.path.abspath(coding_filepath) for coding_filepath in run_filepaths}
+    for counted_filepath in state['coding_files']:
+        if counted_filepath not in run_abspaths:
+            print('Including the scores counted before in {} (from {})'.format(counted_filepath, args.state))
+    # Only new or changed coding files; a file counted before under another path (e.g. moved) is not counted again
+    counted_hashes = {coding_file['sha256'] for coding_file in state['coding_files'].values()}
+    new_filepaths = {}
+    for coding_filepath in run_filepaths:
+        coding_hash = file_sha256(coding_filepath)
+        if coding_hash in counted_hashes:
+            if args.verbose:
+                print('Skipping {}, already counted'.format(coding_filepath))
+            continue
+        counted_hashes.add(coding_hash)
+        new_filepaths[coding_filepath] = coding_hash
+
+    read_file = functools.partial(read_coding_file, args.format)
+    if args.workers > 1:
+        pool = multiprocessing.Pool(args.workers)
+        # imap hands back counts in file order, so they are added up in the same order however many workers there are
+        file_results = pool.imap(read_file, new_filepaths)
+    else:
+        pool = None
+        file_results = map(read_file, new_filepaths)
+
+    for (coding_filepath, coding_hash), (file_format, keyword_counts) in zip(new_filepaths.items(), file_results):
+        print('Counted {} scores for {} keywords in {} ({})'.format(
+            sum(sum(score_counts.values()) for score_counts in keyword_counts.values()), len(keyword_counts),
+            coding_filepath, file_format))
+        # a changed file replaces its old counts, and moves to the end of the order files were counted in
+        state['coding_files'].pop(os.path.abspath(coding_filepath), None)
+        state['coding_files'][os.path.abspath(coding_filepath)] = {
+            'sha256': coding_hash,
+            # JSON keys are strings
+            'keyword_scores': {keyword: {str(score): count for score, count in score_counts.items()}
+                               for keyword, score_counts in keyword_counts.items()}}
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if args.state is not None:
+        save_state(state, args.state)
+    keyword_scores = total_keyword_scores(state)
+
+    # Now merge with keywords file: existing rows keep their place and id, with the mode of the keyword's scores
+    # if it has been coded, and new keywords are added at the end
+    keywords = {row[0] for row in keyword_rows}
+    for keyword in keyword_scores:
+        if keyword not in keywords:
+            print("Adding new keyword ", keyword)
+            keyword_rows.append([keyword, '', ''])
+        elif args.verbose:
+            print("Updating keyword ", keyword)
+
+    with open('keywords_new.csv', 'w', newline='') as new_keyword_file:
+        keywords_new_csv = csv.writer(new_keyword_file)
+        # the same columns as keywords.csv: keyword, score, id
+        for keyword, score, *ids in keyword_rows:
+            if keyword in keyword_scores:
+                score = mode_score(keyword_scores[keyword])
+            keywords_new_csv.writerow([keyword, score, *ids])
@@ -0,0 +1,170 @@
+import csv
+import os
+import re
+import sqlite3
+
+
+# Check if the file has a newline as the last character; if not, add it
+def fix_newline(f):
+    f_length = f.tell()
+    f.seek(f_length-1, 0)
+    lastchar = f.read(1)
+    if lastchar != '\n':
+        f.write('\n')
+
+
+def column_names(headers):
+    """ Unique, lower case column names for the extract headers, e.g. 'Code (N/1-6)' -> 'code_n_1_6' """
+    names = []
+    for header in headers:
+        name = re.sub(r'[^0-9a-z]+', '_', header.lower()).strip('_')
+        unique_name = name
+        suffix = 2
+        while unique_name in names:
+            unique_name = '{}_{}'.format(name, suffix)
+            suffix += 1
+        names.append(unique_name)
+    return names
+
+
+class ExtractSink:
+    """ Where extract rows are written. Rows are buffered until flush(), which ProcessedManifest calls
+    just before it records their documents as processed, so rows only reach the file along with the
+    manifest entries that keep their documents from being processed again. Rows still buffered when
+    the sink is left with an exception are dropped, as their documents were not recorded.
+
+    Subclasses implement _write_rows(), and _close() if needed.
+    """
+    def __init__(self, filepath, headers):
+        self.filepath = filepath
+        self.headers = headers
+        self.rows = []
+        # whether rows are being added to an existing extracts file
+        self.appending = os.path.exists(filepath)
+
+
+    def write(self, row):
+        self.rows.append(row)
+
+
+    def flush(self):
+        if self.rows:
+            self._write_rows(self.rows)
+            self.rows = []
+
+
+    def close(self):
+        self.flush()
+        self._close()
+
+
+    def _close(self):
+        pass
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.rows = []
+        self.close()
+
+
+    def _padded_rows(self, rows):
+        """ Rows with values for every column (extract rows leave out the trailing coding columns) """
+        return [list(row) + [''] * (len(self.headers) - len(row)) for row in rows]
+
+
+class CSVExtractSink(ExtractSink):
+    """ The extracts-*.csv layout coders open in Excel """
+    def __init__(self, filepath, headers):
+        super().__init__(filepath, headers)
+        # If extracts.csv exists, append to it rather than overwriting it.
+        self.extract_file = open(filepath, 'a+' if self.appending else 'w')
+        # If the file was previously saved using Excel, it will be lacking a final \n character.
+        # So, we need to check if it's missing; if so, add it so that appending starts on a new line.
+        if self.appending:
+            fix_newline(self.extract_file)
+        self.extract_csv = csv.writer(self.extract_file)
+        if not self.appending:
+            self.extract_csv.writerow(headers)
+
+
+    def flush(self):
+        super().flush()
+        self.extract_file.flush()
+
+
+    def _write_rows(self, rows):
+        self.extract_csv.writerows(rows)
+
+
+    def _close(self):
+        self.extract_file.close()
+
+
+class SQLiteExtractSink(ExtractSink):
+    """ An extracts table in a SQLite database, indexed on index_columns for querying """
+    def __init__(self, filepath, headers, index_columns=()):
+        super().__init__(filepath, headers)
+        self.columns = column_names(headers)
+        self.connection = sqlite3.connect(filepath)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS extracts ({})'.format(
+            ', '.join('"{}" TEXT'.format(column) for column in self.columns)))
+        for column in index_columns:
+            self.connection.execute('CREATE INDEX IF NOT EXISTS "extracts_{0}" ON extracts ("{0}")'.format(column))
+        self.connection.commit()
+        self.insert = 'INSERT INTO extracts VALUES ({})'.format(', '.join('?' * len(self.columns)))
+
+
+    def flush(self):
+        super().flush()
+        self.connection.commit()
+
+
+    def _write_rows(self, rows):
+        self.connection.executemany(self.insert, self._padded_rows(rows))
+
+
+    def _close(self):
+        self.connection.close()
+
+
+class ParquetExtractSink(ExtractSink):
+    """ A directory of Parquet files, one per run, which pandas or pyarrow read as a single dataset """
+    def __init__(self, filepath, headers, run_id):
+        # pyarrow is optional, and only needed for this sink
+        import pyarrow
+        import pyarrow.parquet
+        super().__init__(filepath, headers)
+        self.pyarrow = pyarrow
+        self.columns = column_names(headers)
+        self.schema = pyarrow.schema([(column, pyarrow.string()) for column in self.columns])
+        os.makedirs(filepath, exist_ok=True)
+        self.writer = pyarrow.parquet.ParquetWriter(os.path.join(filepath, 'part-{}.parquet'.format(run_id)),
+                                                    self.schema)
+
+
+    def _write_rows(self, rows):
+        columns = list(zip(*self._padded_rows(rows)))
+        self.writer.write_table(self.pyarrow.Table.from_arrays(
+            [self.pyarrow.array(values, type=self.pyarrow.string()) for values in columns], schema=self.schema))
+
+
+    def _close(self):
+        self.writer.close()
+
+
+OUTPUT_FORMATS = {'csv': '.csv', 'sqlite': '.sqlite', 'parquet': '.parquet'}
+
+
+def open_extract_sink(output_format, extract_basename, headers, index_columns, run_id):
+    """ The sink writing extracts to extract_basename plus the output format's extension """
+    filepath = extract_basename + OUTPUT_FORMATS[output_format]
+    if output_format == 'sqlite':
+        return SQLiteExtractSink(filepath, headers, index_columns)
+    if output_format == 'parquet':
+        return ParquetExtractSink(filepath, headers, run_id)
+    return CSVExtractSink(filepath, headers)
@@ -0,0 +1,115 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from document import Document
+from lexicon_patterns import is_pattern_entry, PatternTrie, protect_censored_words, SPLIT_CENSOR_MARK_OR_STAR
+import tokenizer
+import vopd
+
+KEYWORDS = ['anti-', 'bull----', 'bull****', 'sh*t', 'f**k', 'd*mn', 'hate']
+
+
+class PatternTrieTest(unittest.TestCase):
+    def setUp(self):
+        self.trie = PatternTrie(filter(is_pattern_entry, KEYWORDS))
+
+
+    def test_pattern_entries(self):
+        self.assertEqual(len(self.trie), 6)
+        self.assertEqual(self.trie.wildcard_entries, 5)
+        self.assertFalse(is_pattern_entry('hate'))
+
+
+    def test_prefix(self):
+        self.assertEqual(self.trie.match('anti-immigrant'), 'anti-')
+        self.assertIsNone(self.trie.match('antique'))
+
+
+    def test_censored_words(self):
+        for word, entry in (('f**k', 'f**k'), ('f*ck', 'f**k'), ('f--k', 'f**k'), ('f_ck', 'f**k'),
+                            ('sh#t', 'sh*t'), ('d@mn', 'd*mn'), ('bull$$$$', 'bull----')):
+            self.assertEqual(self.trie.match(word), entry, word)
+
+
+    def test_spelled_out_words_are_not_censored(self):
+        for word in ('fork', 'fuck', 'shit', 'damn', 'bullshit'):
+            self.assertIsNone(self.trie.match(word), word)
+
+
+    def test_tokenizer_splits_censored_words(self):
+        # which is why they are protected before tokenizing; like nltk 3.4.5, it leaves * alone
+        words = tokenizer.word_tokenize('sh#t bull---- d@mn f--k bull$$$$ f**k')
+        self.assertNotIn('f--k', words)
+        self.assertEqual([word for word in words if self.trie.match(word)], ['f**k'])
+
+
+    def test_protected_words_match_after_tokenizing(self):
+        text = 'what the f**k, that is bull---- and sh*t! d*mn f--k. --f**k-- (sh*t) fork'
+        protected_text = protect_censored_words(text, [self.trie])
+        self.assertEqual(len(protected_text), len(text))
+        words = tokenizer.word_tokenize(protected_text)
+        self.assertEqual([self.trie.match(word) for word in words if self.trie.match(word)],
+                         ['f**k', 'bull----', 'sh*t', 'd*mn', 'f**k', 'f**k', 'sh*t'])
+
+
+    def test_entries_matching_the_same_words(self):
+        self.assertEqual(self.trie.shadowed_entries, [('bull****', 'bull----')])
+        self.assertEqual(self.trie.match('bull****'), 'bull----')
+
+
+    def test_words_kept_whole_are_left_alone(self):
+        text = 'f**k, bull****! sh*t'
+        self.assertEqual(protect_censored_words(text, [self.trie]), text)
+
+
+    def test_words_split_at_stars(self):
+        # for newer versions of nltk, which split words at *
+        self.assertEqual(protect_censored_words('f**k, bull****! sh*t', [self.trie], SPLIT_CENSOR_MARK_OR_STAR),
+                         'f__k, bull____! sh_t')
+
+
+    def test_other_marks_are_left_alone(self):
+        text = 'trump@home made 50% -- a $5 bet, a--b!'
+        self.assertEqual(protect_censored_words(text, [self.trie]), text)
+
+
+class CensoredMatchingTest(unittest.TestCase):
+    def setUp(self):
+        vopd.load_lexicon([['trump', 'I6']], [[keyword, '2', 'K{}'.format(number)] for number, keyword in enumerate(KEYWORDS)],
+                          [])
+        vopd.use_tokenizer('regex')
+
+
+    def test_tokenize_keeps_censored_words(self):
+        words = vopd.tokenize('Trump said BULL---- and sh*t!')
+        self.assertEqual(words, ['trump', 'said', 'bull____', 'and', 'sh*t', '!'])
+        self.assertEqual([vopd.keyword_patterns.match(word) for word in words if vopd.keyword_patterns.match(word)],
+                         ['bull----', 'sh*t'])
+
+
+    def test_offsets_of_censored_words(self):
+        text = 'Trump said BULL---- and sh*t!'
+        words, offsets = vopd.tokenize_offsets(text)
+        self.assertEqual(text[offsets[4]:offsets[5]], 'BULL----')
+        self.assertEqual(text[offsets[8]:offsets[9]], 'sh*t')
+
+
+    def test_censored_words_are_matched(self):
+        matches = vopd.match_document(Document('Trump said that was sh*t', {}), 10, 20)[1]
+        self.assertEqual([(subject, keyword) for subject, keyword, _ in matches], [('trump', 'sh*t')])
+
+
+    def test_exact_entry_matching_the_same_words_as_another(self):
+        # as in keywords.csv, bull**** (K29) is listed after bull---- (K28), which is reported for the censored
+        # words both match; bull**** itself is still an exact match
+        for text, keyword in (('Trump said bull****!', 'bull****'), ('Trump said BULL****', 'bull****'),
+                              ('Trump said bull----', 'bull----'), ('Trump said bull$$$$', 'bull----')):
+            matches = vopd.match_document(Document(text, {}), 10, 20)[1]
+            self.assertEqual([keyword_entry for _, keyword_entry, _ in matches], [keyword], text)
+
+
+if __name__ == '__main__':
+    unittest.main()
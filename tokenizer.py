@@ -0,0 +1,89 @@
+import re
+
+# A word tokenizer built from regular expressions only, so it needs neither nltk nor its punkt data.
+# It follows nltk's word_tokenize(): sentences are split off (here by a simple rule, standing in for
+# punkt), then each sentence is tokenized with the rules of nltk's TreebankWordTokenizer as word_tokenize()
+# uses it in nltk 3.4.5, the version in requirements.txt (later versions also split at * and at dashes).
+# Use benchmark.py --check-tokenizer, with the punkt data installed, to compare the two on a corpus.
+
+# Words whose final period does not end a sentence
+ABBREVIATIONS = {'mr', 'mrs', 'ms', 'dr', 'jr', 'sr', 'st', 'mt', 'ft', 'vs', 'etc', 'prof', 'rev', 'gen', 'gov',
+                 'sen', 'rep', 'pres', 'lt', 'col', 'sgt', 'capt', 'cmdr', 'adm', 'maj', 'inc', 'co', 'corp', 'ltd',
+                 'no', 'jan', 'feb', 'mar', 'apr', 'jun', 'jul', 'aug', 'sep', 'sept', 'oct', 'nov', 'dec'}
+
+# A word ending in . ? or ! (perhaps followed by closing quotes or brackets), and the space after it
+SENTENCE_END = re.compile(r'(\S*?)([.?!])([\]\)}>"\'»”’]*)\s+')
+
+STARTING_QUOTES = [
+    (re.compile('([«“‘„]|[`]+)'), r' \1 '),
+    (re.compile(r'^\"'), r'``'),
+    (re.compile(r'(``)'), r' \1 '),
+    (re.compile(r'([ \(\[{<])(\"|\'{2})'), r'\1 `` '),
+    (re.compile(r"(?i)(\')(?!re|ve|ll|m|t|s|d)(\w)\b"), r'\1 \2'),
+]
+
+PUNCTUATION = [
+    (re.compile(r'([^\.])(\.)([\]\)}>"\'' '»”’ ' r']*)\s*$'), r'\1 \2 \3 '),
+    (re.compile(r'([:,])([^\d])'), r' \1 \2'),
+    (re.compile(r'([:,])$'), r' \1 '),
+    (re.compile(r'\.\.\.'), r' ... '),
+    (re.compile(r'[;@#$%&]'), r' \g<0> '),
+    (re.compile(r'([^\.])(\.)([\]\)}>"\']*)\s*$'), r'\1 \2\3 '),
+    (re.compile(r'[?!]'), r' \g<0> '),
+    (re.compile(r"([^'])' "), r"\1 ' "),
+]
+
+PARENS_BRACKETS = (re.compile(r'[\]\[\(\)\{\}\<\>]'), r' \g<0> ')
+
+DOUBLE_DASHES = (re.compile(r'--'), r' -- ')
+
+ENDING_QUOTES = [
+    (re.compile('([»”’])'), r' \1 '),
+    (re.compile(r'"'), " '' "),
+    (re.compile(r"(\S)(\'\')"), r'\1 \2 '),
+    (re.compile(r"([^' ])('[sS]|'[mM]|'[dD]|') "), r'\1 \2 '),
+    (re.compile(r"([^' ])('ll|'LL|'re|'RE|'ve|'VE|n't|N'T) "), r'\1 \2 '),
+]
+
+CONTRACTIONS = [re.compile(pattern) for pattern in (
+    r'(?i)\b(can)(?#X)(not)\b', r"(?i)\b(d)(?#X)('ye)\b", r'(?i)\b(gim)(?#X)(me)\b', r'(?i)\b(gon)(?#X)(na)\b',
+    r'(?i)\b(got)(?#X)(ta)\b', r'(?i)\b(lem)(?#X)(me)\b', r"(?i)\b(mor)(?#X)('n)\b", r'(?i)\b(wan)(?#X)(na)\s',
+    r"(?i) ('t)(?#X)(is)\b", r"(?i) ('t)(?#X)(was)\b")]
+
+
+def sentences(text):
+    """ Split text into sentences after . ? and !, except after abbreviations and initials """
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        word, end_mark = match.group(1), match.group(2)
+        if end_mark == '.' and (word.lower() in ABBREVIATIONS or len(word) == 1 or '.' in word):
+            continue
+        yield text[start:match.end()]
+        start = match.end()
+    if start < len(text):
+        yield text[start:]
+
+
+def sentence_tokenize(text):
+    """ Tokenize a single sentence, as nltk's word_tokenize() does with each sentence """
+    for regexp, substitution in STARTING_QUOTES:
+        text = regexp.sub(substitution, text)
+    for regexp, substitution in PUNCTUATION:
+        text = regexp.sub(substitution, text)
+
+    regexp, substitution = PARENS_BRACKETS
+    text = regexp.sub(substitution, text)
+    regexp, substitution = DOUBLE_DASHES
+    text = regexp.sub(substitution, text)
+
+    # add extra space to make things easier
+    text = ' ' + text + ' '
+    for regexp, substitution in ENDING_QUOTES:
+        text = regexp.sub(substitution, text)
+    for regexp in CONTRACTIONS:
+        text = regexp.sub(r' \1 \2 ', text)
+    return text.split()
+
+
+def word_tokenize(text):
+    return [token for sentence in sentences(text) for token in sentence_tokenize(sentence)]
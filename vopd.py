@@ -1,15 +1,38 @@
 import argparse
+import array
+import collections
+import compiled_lexicon
+import cProfile
 import config
+from corpus_stats import CorpusStats
 import csv
 import datetime
-from document import PDFTranscriptDocumentSet, SFMExtractDocumentSet, EmailExtractDocumentSet
+import email.utils
+import functools
+import hashlib
+import importlib
+import itertools
+import json
+from lexicon_patterns import (is_pattern_entry, PatternTrie, protect_censored_words, SPLIT_CENSOR_MARK,
+                              SPLIT_CENSOR_MARK_OR_STAR)
+from manifest import file_sha256, ProcessedManifest
+from match_memo import MatchMemo
+import multiprocessing
+from document import (ExtractedTextCache, InputFileError, PDFTranscriptDocumentSet, SFMExtractDocumentSet,
+                      EmailExtractDocumentSet)
 import os
+from profiling import RunProfile
 import pytz
 import re
+import shutil
+import signal
+from sinks import open_extract_sink, OUTPUT_FORMATS
+import sys
+import time
+import tokenizer
+import traceback
 
-from nltk.tokenize import word_tokenize
-import nltk
-nltk.download('punkt')
+# nltk, numpy and pandas are slow to import, so they are only imported by the code that uses them
 
 TIME_ZONE = config.time_zone
 
@@ -20,17 +43,439 @@ keyword_id = {}
 subjects = []
 keywords = []
 normalize_terms = {}
+# hashed lexicon indexes, built once after the lists above are read
+subject_index = set()
+keyword_index = set()
+# prefix and wildcard entries (e.g. "anti-", "f**k"), or None if a list has none; see lexicon_patterns.py
+subject_patterns = None
+keyword_patterns = None
+# normalize_terms compiled into a single regex, see compile_normalize_terms()
+normalize_pattern = None
+# id of each subject and keyword (and word matching a prefix or wildcard entry), for batch matching; token_kinds[id] has the
+# SUBJECT_TOKEN and/or KEYWORD_TOKEN bits set (id 0 is any other word)
+token_ids = {}
+token_kinds = bytearray(1)
 
+SUBJECT_TOKEN = 1
+KEYWORD_TOKEN = 2
+# Joins the texts of a batch; neither a letter nor part of any normalize term
+BATCH_SEPARATOR = '\x00'
+# Words joined by a period, e.g. "u.s", which clean_text() splits up
+WORDS_PERIOD = re.compile(r'([a-z])\.([a-z])')
+# A double quote, which the tokenizers give as `` or ''
+DOUBLE_QUOTE = re.compile(r'"|``|\'\'')
+# Changed whenever the same lexicon can match different words (2: prefix and wildcard entries; 3: censored
+# words kept whole for wildcard entries; 4: words the tokenizers keep whole left as they are), so that the
+# manifest does not skip documents processed under the old rules
+MATCHING_RULES = 4
+# With --merge-extracts, a merged extract is at most this many times as long as the extract of a single match,
+# so that a dense passage is split into several extracts rather than making one huge one
+MERGED_EXTRACT_SPANS = 4
+# Separates the entries (and codes) matched in a merged extract's region, listed in one column
+MERGED_ENTRY_SEPARATOR = '; '
+# Name of the compiled lexicon in the cache directory, see load_lexicon_compiled()
+COMPILED_LEXICON_FILENAME = 'lexicon.compiled'
+# MatchMemo remembering the matches of each text, so that repeated tweet and email texts are only matched once;
+# None when not used (--memo-size 0). Cleared whenever the lexicon changes.
+match_memo = None
+# cProfile.Profile enabled only around the matching stage, with --profile-matching
+matching_profiler = None
+# Functions splitting text into words, and into sentences and a sentence into words, set by use_tokenizer();
+# word_tokenize(text) is the words of each sentence in split_sentences(text)
+word_tokenize = None
+split_sentences = None
+sentence_tokenize = None
+# The censor marks the tokenizer splits words at, which clean_text() keeps censored words from being split at
+censor_split_marks = SPLIT_CENSOR_MARK
+# nltk data (i.e. the punkt tokenizer) can be placed here, for machines without network access
+BUNDLED_NLTK_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nltk_data')
 
-def tokenize(document_text):
+
+# Build a regex from a character trie of the terms, e.g. "african american(?:s)?"
+# At each branch the longer continuation is tried first, so the longest term wins.
+def _trie_pattern(node):
+    terminal = '' in node
+    branches = [re.escape(char) + _trie_pattern(child) for char, child in sorted(node.items()) if char != '']
+    if not branches:
+        return ''
+    if len(branches) == 1 and not terminal:
+        return branches[0]
+    pattern = '(?:' + '|'.join(branches) + ')'
+    return pattern + '?' if terminal else pattern
+
+
+# Compile the normalize terms into a single pattern, so that one left-to-right scan replaces
+# the longest term starting at each position (e.g. "african americans" wins over "african american"),
+# whatever order the file lists them in.
+def compile_normalize_terms(terms):
+    trie = {}
+    for term in terms:
+        if not term:
+            continue
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    if not trie:
+        return None
+    return re.compile(_trie_pattern(trie))
+
+
+# (Re)populate the global lexicon lists, maps and indexes from the rows of the
+# subjects, keywords and normalize terms CSV files
+def load_lexicon(subject_rows, keyword_rows, normalize_rows):
+    global normalize_pattern, subject_patterns, keyword_patterns
+    for lexicon_global in (subject_map, keyword_map, keyword_id, subjects, keywords, normalize_terms,
+                           subject_index, keyword_index):
+        lexicon_global.clear()
+    if match_memo is not None:
+        match_memo.clear()
+
+    for row in subject_rows:
+        subjects.append(row[0])
+        subject_map[row[0]] = row[1]
+
+    for row in keyword_rows:
+        keywords.append(row[0])
+        keyword_map[row[0]] = row[1]
+        keyword_id[row[0]] = row[2]
+
+    for row in normalize_rows:
+        normalize_terms[row[0]] = row[1]
+
+    normalize_pattern = compile_normalize_terms(normalize_terms)
+    subject_index.update(subjects)
+    keyword_index.update(keywords)
+    subject_patterns = PatternTrie(filter(is_pattern_entry, subjects)) or None
+    keyword_patterns = PatternTrie(filter(is_pattern_entry, keywords)) or None
+
+    token_ids.clear()
+    del token_kinds[1:]
+    for word in itertools.chain(subjects, keywords):
+        if word not in token_ids:
+            token_ids[word] = len(token_kinds)
+            token_kinds.append(token_kind(word))
+
+
+# The global lexicon lists, maps and indexes built by load_lexicon(), as saved in a compiled lexicon
+def lexicon_tables():
+    return {'subjects': subjects, 'subject_map': subject_map,
+            'keywords': keywords, 'keyword_map': keyword_map, 'keyword_id': keyword_id,
+            'normalize_terms': normalize_terms, 'normalize_pattern': normalize_pattern,
+            'subject_index': subject_index, 'keyword_index': keyword_index,
+            'subject_patterns': subject_patterns, 'keyword_patterns': keyword_patterns,
+            'token_ids': token_ids, 'token_kinds': bytes(token_kinds)}
+
+
+# Set the global lexicon lists, maps and indexes to the tables of a compiled lexicon
+def use_lexicon_tables(tables):
+    global subjects, subject_map, keywords, keyword_map, keyword_id, normalize_terms, normalize_pattern, \
+        subject_index, keyword_index, subject_patterns, keyword_patterns, token_ids, token_kinds
+    subjects = tables['subjects']
+    subject_map = tables['subject_map']
+    keywords = tables['keywords']
+    keyword_map = tables['keyword_map']
+    keyword_id = tables['keyword_id']
+    normalize_terms = tables['normalize_terms']
+    normalize_pattern = tables['normalize_pattern']
+    subject_index = tables['subject_index']
+    keyword_index = tables['keyword_index']
+    subject_patterns = tables['subject_patterns']
+    keyword_patterns = tables['keyword_patterns']
+    token_ids = tables['token_ids']
+    token_kinds = bytearray(tables['token_kinds'])
+    if match_memo is not None:
+        match_memo.clear()
+
+
+# Set up the lexicon from the rows of the subjects, keywords and normalize terms CSV files, as load_lexicon(),
+# loading it from the compiled lexicon in cache_dir if that was compiled from the same rows; otherwise it is
+# built, and compiled there for the next run (or, with recompile, always).
+# Without a cache_dir, or if the compiled lexicon cannot be written, it is just built.
+def load_lexicon_compiled(lexicon_rows, cache_dir, recompile=False):
+    if cache_dir is None:
+        load_lexicon(*lexicon_rows)
+        return
+    compiled_filepath = os.path.join(cache_dir, COMPILED_LEXICON_FILENAME)
+    rows_hash = compiled_lexicon.source_hash(lexicon_rows, MATCHING_RULES)
+    tables = None if recompile else compiled_lexicon.read(compiled_filepath, rows_hash)
+    if tables is not None:
+        use_lexicon_tables(tables)
+        return
+    load_lexicon(*lexicon_rows)
+    try:
+        compiled_lexicon.write(compiled_filepath, rows_hash, lexicon_tables())
+    except OSError as error:
+        # the compiled lexicon is only an optimization; carry on without it
+        print('Could not write the compiled lexicon {}: {}'.format(compiled_filepath, error))
+
+
+# Warn of prefix and wildcard entries that match the same words as an entry listed before them: censored words
+# they match are reported as that entry
+def warn_shadowed_entries():
+    for kind, patterns, entry_code in (('subject', subject_patterns, subject_map), ('keyword', keyword_patterns, keyword_id)):
+        if patterns is None:
+            continue
+        for entry, kept_entry in patterns.shadowed_entries:
+            print('Warning: the {} {} ({}) matches the same censored words as {} ({}), listed before it, so they are '
+                  'reported as {}'.format(kind, entry, entry_code[entry], kept_entry, entry_code[kept_entry], kept_entry))
+
+
+# The subject entry a word matches: the word itself, or a prefix or wildcard entry; None if neither
+def subject_entry(word):
+    if word in subject_index:
+        return word
+    return subject_patterns.match(word) if subject_patterns is not None else None
+
+
+# The keyword entry a word matches: the word itself, or a prefix or wildcard entry; None if neither
+def keyword_entry(word):
+    if word in keyword_index:
+        return word
+    return keyword_patterns.match(word) if keyword_patterns is not None else None
+
+
+# SUBJECT_TOKEN and/or KEYWORD_TOKEN bits for a word
+def token_kind(word):
+    return (SUBJECT_TOKEN if subject_entry(word) else 0) | (KEYWORD_TOKEN if keyword_entry(word) else 0)
+
+
+# Id of a word that is not itself in the lexicon, for batch matching: words matching a prefix or
+# wildcard entry are added to token_ids when first seen; any other word is 0
+def pattern_token_id(word):
+    if subject_patterns is None and keyword_patterns is None:
+        return 0
+    kind = token_kind(word)
+    if not kind:
+        return 0
+    token_ids[word] = len(token_kinds)
+    token_kinds.append(kind)
+    return token_ids[word]
+
+
+# The prefix and wildcard entry tries with wildcard entries, whose censored words are kept whole by clean_text()
+def censored_word_tries():
+    return [patterns for patterns in (subject_patterns, keyword_patterns)
+            if patterns is not None and patterns.wildcard_entries]
+
+
+def clean_text(document_text):
     # Convert to lower case
     clean_document_text = document_text.lower()
+    # Keep censored words the lexicon matches (e.g. "f**k") from being split up by the tokenizer
+    tries = censored_word_tries()
+    if tries:
+        clean_document_text = protect_censored_words(clean_document_text, tries, censor_split_marks)
     # Split words by periods
-    clean_document_text = re.sub(r'([a-z])\.([a-z])', r'\1. \2', clean_document_text)
+    clean_document_text = WORDS_PERIOD.sub(r'\1. \2', clean_document_text)
+
+    # Replace multi-word terms with their normalized forms in one pass
+    if normalize_pattern is not None:
+        clean_document_text = normalize_pattern.sub(lambda match: normalize_terms[match.group(0)],
+                                                    clean_document_text)
+    return clean_document_text
+
+
+# clean_text(), also returning where each character of the clean text comes from in document_text, as an
+# array('I') of the offset of each character and then of the end of the text, all plus base
+def clean_text_offsets(document_text, base=0):
+    clean_document_text = document_text.lower()
+    if len(clean_document_text) == len(document_text):
+        char_offsets = array.array('I', range(base, base + len(document_text) + 1))
+    else:
+        # a few characters have more than one in lower case, e.g. "İ"
+        char_offsets = array.array('I')
+        for offset, char in enumerate(document_text, base):
+            char_offsets.extend([offset] * len(char.lower()))
+        char_offsets.append(base + len(document_text))
+    tries = censored_word_tries()
+    if tries:
+        # keeps the text's length
+        clean_document_text = protect_censored_words(clean_document_text, tries, censor_split_marks)
+    clean_document_text, char_offsets = replace_offsets(WORDS_PERIOD, lambda match: match.expand(r'\1. \2'),
+                                                        clean_document_text, char_offsets)
+    if normalize_pattern is not None:
+        clean_document_text, char_offsets = replace_offsets(normalize_pattern,
+                                                            lambda match: normalize_terms[match.group(0)],
+                                                            clean_document_text, char_offsets)
+    return clean_document_text, char_offsets
+
+
+# Replace each match of pattern in text with replace(match), as pattern.sub(), and the offsets of its characters
+# to match: the characters of a replacement come from those of the text it replaces, in turn, with any left
+# over from the last of them. So "u.s" becoming "u. s" keeps the offsets of "u" and "s", and a normalize term's
+# replacement runs from the start to the end of the term.
+def replace_offsets(pattern, replace, text, char_offsets):
+    pieces = []
+    new_offsets = array.array('I')
+    last_end = 0
+    for match in pattern.finditer(text):
+        start, end = match.span()
+        replacement = replace(match)
+        pieces.append(text[last_end:start])
+        pieces.append(replacement)
+        new_offsets.extend(char_offsets[last_end:start])
+        kept = min(len(replacement), end - start)
+        new_offsets.extend(char_offsets[start:start + kept])
+        new_offsets.extend([char_offsets[end - 1]] * (len(replacement) - kept))
+        last_end = end
+    if not pieces:
+        return text, char_offsets
+    pieces.append(text[last_end:])
+    new_offsets.extend(char_offsets[last_end:])
+    return ''.join(pieces), new_offsets
+
+
+# The offsets of words, the tokens of clean_document_text, in the text it was cleaned from, as an array('I') of
+# each word's start and end. char_offsets[char_start + i] is the offset of character i of clean_document_text
+# (see clean_text_offsets()), and base is taken off every offset.
+# Each word is looked for from the end of the word before it.
+def token_offsets(clean_document_text, words, char_offsets, char_start=0, base=0):
+    offsets = array.array('I')
+    position = 0
+    for word in words:
+        if word == '``' or word == "''":
+            # a double quote, as the tokenizers give it
+            match = DOUBLE_QUOTE.search(clean_document_text, position)
+            start, end = match.span() if match is not None else (position, position)
+        else:
+            start = clean_document_text.find(word, position)
+            if start < 0:
+                # not in the text as it is; it is given none of the text
+                start = position
+                end = position
+            else:
+                end = start + len(word)
+        offsets.append(char_offsets[char_start + start] - base)
+        offsets.append(char_offsets[char_start + end] - base)
+        position = end
+    return offsets
+
+
+# Choose the word tokenizer: nltk's word_tokenize, or the regex tokenizer in tokenizer.py.
+# nltk's punkt data is looked up in nltk_data, the NLTK_DATA environment variable, BUNDLED_NLTK_DATA,
+# and nltk's usual locations; it is never downloaded.
+def use_tokenizer(tokenizer_name='nltk', nltk_data=None):
+    global word_tokenize, split_sentences, sentence_tokenize, censor_split_marks
+    if tokenizer_name == 'regex':
+        word_tokenize = tokenizer.word_tokenize
+        split_sentences = tokenizer.sentences
+        sentence_tokenize = tokenizer.sentence_tokenize
+        censor_split_marks = SPLIT_CENSOR_MARK
+        return
+
+    import nltk
+    from nltk.tokenize import sent_tokenize, word_tokenize as nltk_word_tokenize
+    # the tokenizer nltk's word_tokenize uses for each sentence
+    from nltk.tokenize import _treebank_word_tokenizer
+    for data_path in (BUNDLED_NLTK_DATA, nltk_data):
+        if data_path and data_path not in nltk.data.path:
+            nltk.data.path.insert(0, data_path)
+    try:
+        nltk_word_tokenize('Check that the punkt tokenizer is installed.')
+    except LookupError:
+        print('The nltk punkt tokenizer data was not found. Install it with nltk.download(\'punkt\') (or, for newer nltk, '
+              '\'punkt_tab\'), into {} or a directory given by --nltk-data, or use --tokenizer regex'.format(BUNDLED_NLTK_DATA))
+        sys.exit(1)
+    word_tokenize = nltk_word_tokenize
+    split_sentences = sent_tokenize
+    sentence_tokenize = _treebank_word_tokenizer.tokenize
+    # nltk 3.4.5 keeps words censored with "*" whole, newer versions split them
+    censor_split_marks = SPLIT_CENSOR_MARK if len(sentence_tokenize('f**k')) == 1 else SPLIT_CENSOR_MARK_OR_STAR
+
+
+def tokenize(document_text):
+    if word_tokenize is None:
+        use_tokenizer()
+    return word_tokenize(clean_text(document_text))
+
+
+# tokenize(), also returning the offsets of the words in document_text (see token_offsets())
+def tokenize_offsets(document_text):
+    if word_tokenize is None:
+        use_tokenizer()
+    clean_document_text, char_offsets = clean_text_offsets(document_text)
+    document_words = word_tokenize(clean_document_text)
+    return document_words, token_offsets(clean_document_text, document_words, char_offsets)
+
+
+# Tokenize a document's text a page at a time, yielding the words of each page.
+# The last sentence of each page is held back and tokenized with the next page, so that a
+# sentence running over a page break is tokenized as in tokenize() of the whole text.
+def tokenize_pages(page_texts):
+    if word_tokenize is None:
+        use_tokenizer()
+    carried_text = ''
+    for page_text in page_texts:
+        clean_page_text = carried_text + clean_text(page_text)
+        sentences = list(split_sentences(clean_page_text))
+        if not sentences:
+            carried_text = clean_page_text
+            continue
+        # the sentences are pieces of the text, so the last one is its last occurrence
+        carried_text = clean_page_text[clean_page_text.rfind(sentences[-1]):]
+        yield [word for sentence in sentences[:-1] for word in sentence_tokenize(sentence)]
+    yield word_tokenize(carried_text)
+
+
+# tokenize_pages(), also yielding the offsets of each page's words in the text of the whole document
+# (see token_offsets())
+def tokenize_pages_offsets(page_texts):
+    if word_tokenize is None:
+        use_tokenizer()
+    carried_text = ''
+    # the offsets of the characters of carried_text, without that of its end
+    carried_offsets = array.array('I')
+    page_start = 0
+    for page_text in page_texts:
+        clean_page_text, char_offsets = clean_text_offsets(page_text, page_start)
+        page_start += len(page_text)
+        clean_page_text = carried_text + clean_page_text
+        char_offsets = carried_offsets + char_offsets
+        sentences = list(split_sentences(clean_page_text))
+        if not sentences:
+            carried_text = clean_page_text
+            carried_offsets = char_offsets[:-1]
+            continue
+        carried_start = clean_page_text.rfind(sentences[-1])
+        carried_text = clean_page_text[carried_start:]
+        carried_offsets = char_offsets[carried_start:-1]
+        page_words = [word for sentence in sentences[:-1] for word in sentence_tokenize(sentence)]
+        yield page_words, token_offsets(clean_page_text, page_words, char_offsets)
+    carried_offsets.append(page_start)
+    page_words = word_tokenize(carried_text)
+    yield page_words, token_offsets(carried_text, page_words, carried_offsets)
 
-    for term, normalized_term in normalize_terms.items():
-        clean_document_text = clean_document_text.replace(term, normalized_term)
-    return word_tokenize(clean_document_text)
+
+# Tokenize a batch of texts, cleaning them all in one pass over the joined text
+def tokenize_batch(document_texts):
+    if word_tokenize is None:
+        use_tokenizer()
+    batch_text = BATCH_SEPARATOR.join(document_texts)
+    if batch_text.count(BATCH_SEPARATOR) != len(document_texts) - 1:
+        # a text contains the separator itself, so the cleaned text could not be split back up
+        return [tokenize(document_text) for document_text in document_texts]
+    return [word_tokenize(clean_document_text)
+            for clean_document_text in clean_text(batch_text).split(BATCH_SEPARATOR)]
+
+
+# tokenize_batch(), also returning the offsets of the words of each text in that text (see token_offsets())
+def tokenize_batch_offsets(document_texts):
+    if word_tokenize is None:
+        use_tokenizer()
+    batch_text = BATCH_SEPARATOR.join(document_texts)
+    if batch_text.count(BATCH_SEPARATOR) != len(document_texts) - 1:
+        return [tokenize_offsets(document_text) for document_text in document_texts]
+    clean_batch_text, char_offsets = clean_text_offsets(batch_text)
+    batch_words = []
+    clean_start = 0
+    for clean_document_text in clean_batch_text.split(BATCH_SEPARATOR):
+        document_words = word_tokenize(clean_document_text)
+        # each text starts just after a separator, which cleaning leaves as it is
+        batch_words.append((document_words, token_offsets(clean_document_text, document_words, char_offsets,
+                                                          clean_start, char_offsets[clean_start])))
+        clean_start += len(clean_document_text) + len(BATCH_SEPARATOR)
+    return batch_words
 
 
 # Return windows that start with the first two words, increasing to size window_size,
@@ -44,10 +489,16 @@ def window_iter(document_words, window_size):
         yield left_index, right_index, document_words[left_index:right_index+1]
 
 
-def matching_word_list(words, word_list):
+# The first word in words that is in word_list, or matches one of its prefix or wildcard patterns,
+# and the entry it matches
+def matching_word_list(words, word_list, patterns=None):
     for pos, word in enumerate(words):
         if word in word_list:
             return pos, word
+        if patterns is not None:
+            entry = patterns.match(word)
+            if entry is not None:
+                return pos, entry
     return None, None
 
 
@@ -57,78 +508,599 @@ def context(transcript_words, word_pos1, word_pos2, context_size=20):
     return transcript_words[context_start:context_end]
 
 
+# The text the words from start to end (which can be past the last word) were tokenized from, given the words'
+# offsets in the document (see tokenize_offsets()) and its text from text_start on; each run of whitespace in it,
+# e.g. a line or page break, is given as one space
+def original_extract(text, word_offsets, start, end, text_start=0):
+    end = min(end, len(word_offsets) // 2)
+    if start >= end:
+        return ''
+    return ' '.join(text[word_offsets[2 * start] - text_start:word_offsets[2 * end - 1] - text_start].split())
+
+
+# The span of words extracted for each of the matches an engine yields:
+# (subject, keyword, extract start, extract end), as context() (the end can be past the last word)
+def match_spans(engine_matches, context_size=20):
+    for subject, subject_pos, keyword, keyword_pos in engine_matches:
+        yield (subject, keyword, max(min(subject_pos, keyword_pos) - context_size, 0),
+               max(subject_pos, keyword_pos) + context_size)
+
+
+# Longest region of merged match spans, in words, for the window and context sizes
+def max_merged_words(window_size, context_size):
+    return MERGED_EXTRACT_SPANS * (window_size + 1 + 2 * context_size)
+
+
+# A region of overlapping match spans, [subjects, keywords, start, end], starting with a single span
+def new_region(span):
+    subject, keyword, start, end = span
+    return [[subject], [keyword], start, end]
+
+
+# Add a match span to a region if it overlaps it, unless that would make the region longer than max_words.
+# Returns whether the span was added.
+def merge_span(region, span, max_words):
+    subject, keyword, start, end = span
+    if start >= region[3] or max(end, region[3]) - region[2] > max_words:
+        return False
+    region[0].append(subject)
+    region[1].append(keyword)
+    region[3] = max(end, region[3])
+    return True
+
+
+# The span of a region: its subjects and keywords (each entry once, in order of their matches), start and end
+def region_span(region):
+    subjects, keywords, start, end = region
+    return tuple(dict.fromkeys(subjects)), tuple(dict.fromkeys(keywords)), start, end
+
+
+# Merge match spans, in order of their start (as the engines yield matches), into regions of overlapping spans,
+# yielding the span of each region as soon as a span that does not overlap it comes along
+def merged_spans(spans, max_words):
+    region = None
+    for span in spans:
+        if region is None or not merge_span(region, span, max_words):
+            if region is not None:
+                yield region_span(region)
+            region = new_region(span)
+    if region is not None:
+        yield region_span(region)
+
+
+# The subject, subject_code, keyword, keyword_code and keyword_id columns of a match.
+# For a merged extract, subject and keyword are tuples of the entries matched in its region, listed in
+# each column (and their codes likewise, in the same order) separated by MERGED_ENTRY_SEPARATOR.
+def lexicon_columns(subject, keyword):
+    if isinstance(subject, str):
+        return [subject, subject_map[subject], keyword, keyword_map[keyword], keyword_id[keyword]]
+    return [MERGED_ENTRY_SEPARATOR.join(subject),
+            MERGED_ENTRY_SEPARATOR.join(subject_map[entry] for entry in subject),
+            MERGED_ENTRY_SEPARATOR.join(keyword),
+            MERGED_ENTRY_SEPARATOR.join(keyword_map[entry] for entry in keyword),
+            MERGED_ENTRY_SEPARATOR.join(keyword_id[entry] for entry in keyword)]
+
+
+# The subject and keyword code pairs of an extract row; a merged extract has one for each of its subjects
+# with each of its keywords
+def match_code_pairs(subject, keyword):
+    if isinstance(subject, str):
+        return [(subject_map[subject], keyword_map[keyword])]
+    return [(subject_map[subject_entry], keyword_map[keyword_entry])
+            for subject_entry in subject for keyword_entry in keyword]
+
+
 def process_document_iter(document_words, window_size=10):
     for start, end, window_words in window_iter(document_words, window_size):
         # Compare with the right-most word as the potential subject; look for keywords
-        subject_pos, subject = matching_word_list([window_words[-1]], subjects)
+        subject_pos, subject = matching_word_list([window_words[-1]], subjects, subject_patterns)
         if subject_pos is not None:
-            keyword_pos, keyword = matching_word_list(window_words[0:-1], keywords)
+            keyword_pos, keyword = matching_word_list(window_words[0:-1], keywords, keyword_patterns)
             if keyword_pos is not None:
                 # A subject and keyword found, where the subject is to the left of the keyword
                 yield subject, start + subject_pos, keyword, start + keyword_pos
         # Compare with the right-most word as the potential keyword; look for subjects
-        keyword_pos, keyword = matching_word_list([window_words[-1]], keywords)
+        keyword_pos, keyword = matching_word_list([window_words[-1]], keywords, keyword_patterns)
         if keyword_pos is not None:
-            subject_pos, subject = matching_word_list(window_words[0:-1], subjects)
+            subject_pos, subject = matching_word_list(window_words[0:-1], subjects, subject_patterns)
             if subject_pos is not None:
                 # A subject and keyword found, where the keyword is to the left of the subject
                 yield subject, start + subject_pos, keyword, start + keyword_pos
 
 
-# Check if the file has a newline as the last character; if not, add it
-def fix_newline(f):
-    f_length = f.tell()
-    f.seek(f_length-1, 0)
-    lastchar = f.read(1)
-    if lastchar != '\n':
-        f.write('\n')
+# Single-pass equivalent of process_document_iter: walks the words once, remembering the
+# positions of subjects and keywords still inside the window, and looks each word up in
+# the hashed indexes (and the prefix and wildcard tries) instead of scanning the lexicon lists.
+# Yields exactly the same (subject, subject_pos, keyword, keyword_pos) tuples, in the same order.
+def process_document_iter_indexed(document_words, window_size=10):
+    recent_subjects = collections.deque()
+    recent_keywords = collections.deque()
+    for right_index, word in enumerate(document_words):
+        left_index = max(0, right_index - window_size)
+        # Forget positions that have slid out of the window
+        while recent_subjects and recent_subjects[0][0] < left_index:
+            recent_subjects.popleft()
+        while recent_keywords and recent_keywords[0][0] < left_index:
+            recent_keywords.popleft()
 
+        # The entries the word matches, if any (inlined subject_entry and keyword_entry)
+        subject = word if word in subject_index else subject_patterns is not None and subject_patterns.match(word)
+        keyword = word if word in keyword_index else keyword_patterns is not None and keyword_patterns.match(word)
+        # The right-most word is a subject; the left-most keyword in the window pairs with it.
+        # Like process_document_iter, the right-most word is reported at the window's start position.
+        if subject and recent_keywords:
+            keyword_pos, window_keyword = recent_keywords[0]
+            yield subject, left_index, window_keyword, keyword_pos
+        # The right-most word is a keyword; the left-most subject in the window pairs with it
+        if keyword and recent_subjects:
+            subject_pos, window_subject = recent_subjects[0]
+            yield window_subject, subject_pos, keyword, left_index
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--window', help='number of words that subject and keyword must be within (default = 5)', type=int,
-                        default=10)
-    parser.add_argument('--context', help='number of words before and after subject and keyword to extract (default = 20)', type=int,
-                        default=20)
-    parser.add_argument('--subjectfile', help='subject list file (default = subjects.csv)', type=argparse.FileType('r'),
-                        default='subjects.csv')
-    parser.add_argument('--keywordfile', help='keyword list file (default = keywords.csv)', type=argparse.FileType('r'),
-                        default='keywords.csv')
-    parser.add_argument('--normalizefile', help='normalize terms file (default = normalize_terms.csv)', type=argparse.FileType('r'),
-                        default='normalize_terms.csv')
-    parser.add_argument('--mode', help='Mode: pdf or tweets or email', type=str,
-                        default='pdf')
-    parser.add_argument("--verbose", help="increase output verbosity",
-                        action="store_true")
-    parser.add_argument('transcript', help='filepath to transcript pdf or directory, or to SFM extract Excel file')
+        if subject:
+            recent_subjects.append((right_index, subject))
+        if keyword:
+            recent_keywords.append((right_index, keyword))
 
-    args = parser.parse_args()
 
-    # Read subjects, keywords, and normalize_terms
-    with args.subjectfile as subjects_file:
-        subjects_csv = csv.reader(subjects_file)
-        for row in subjects_csv:
-            subjects += [row[0]]
-            subject_map[row[0]] = row[1]
+# Batch equivalent of process_document_iter: returns, for each list of words in batch_words,
+# the list of matches process_document_iter would yield. All the words are laid end to end
+# and mapped to lexicon ids, and for every subject (keyword) the left-most keyword (subject)
+# in its window is found with a binary search over the sorted keyword (subject) positions.
+def process_documents_batch(batch_words, window_size=10):
+    import numpy as np
 
-    with args.keywordfile as keywords_file:
-        keywords_csv = csv.reader(keywords_file)
-        for row in keywords_csv:
-            keywords += [row[0]]
-            keyword_map[row[0]] = row[1]
-            keyword_id[row[0]] = row[2]
+    batch_matches = [[] for document_words in batch_words]
+    all_words = list(itertools.chain.from_iterable(batch_words))
+    if not all_words:
+        return batch_matches
+
+    lengths = np.fromiter(map(len, batch_words), dtype=np.int64, count=len(batch_words))
+    document_starts = np.cumsum(lengths) - lengths
+    document_of = np.repeat(np.arange(len(batch_words)), lengths)
+    ids = np.fromiter((token_ids.get(word) or pattern_token_id(word) for word in all_words), dtype=np.int64,
+                      count=len(all_words))
+    kinds = np.frombuffer(bytes(token_kinds), dtype=np.uint8)[ids]
+    # window of each word: from left_indexes up to the word itself, within the word's document
+    left_indexes = np.maximum(document_starts[document_of], np.arange(len(all_words)) - window_size)
+    subject_positions = np.flatnonzero(kinds & SUBJECT_TOKEN)
+    keyword_positions = np.flatnonzero(kinds & KEYWORD_TOKEN)
+
+    def left_most_partners(right_positions, partner_positions):
+        # the first partner at or after each window's left index, if it is before the right-most word
+        if len(right_positions) == 0 or len(partner_positions) == 0:
+            return right_positions[:0], right_positions[:0]
+        partner_indexes = np.searchsorted(partner_positions, left_indexes[right_positions])
+        in_range = partner_indexes < len(partner_positions)
+        partners = partner_positions[np.minimum(partner_indexes, len(partner_positions) - 1)]
+        found = in_range & (partners < right_positions)
+        return right_positions[found], partners[found]
+
+    subject_rights, keyword_lefts = left_most_partners(subject_positions, keyword_positions)
+    keyword_rights, subject_lefts = left_most_partners(keyword_positions, subject_positions)
+
+    # Order matches as process_document_iter does: by right-most word, subject-on-the-right first
+    rights = np.concatenate((subject_rights, keyword_rights))
+    partners = np.concatenate((keyword_lefts, subject_lefts))
+    subject_on_right = np.concatenate((np.ones(len(subject_rights), dtype=bool),
+                                       np.zeros(len(keyword_rights), dtype=bool)))
+    order = np.lexsort((~subject_on_right, rights))
+    for right, partner, is_subject_right in zip(rights[order].tolist(), partners[order].tolist(),
+                                                subject_on_right[order].tolist()):
+        document = int(document_of[right])
+        start = int(document_starts[document])
+        # As in process_document_iter, the right-most word is reported at the window's start position
+        right_pos = int(left_indexes[right] - start)
+        if is_subject_right:
+            match = (subject_entry(all_words[right]), right_pos, keyword_entry(all_words[partner]), partner - start)
+        else:
+            match = (subject_entry(all_words[partner]), partner - start, keyword_entry(all_words[right]), right_pos)
+        batch_matches[document].append(match)
+    return batch_matches
+
+
+match_engines = {'scan': process_document_iter,
+                 'indexed': process_document_iter_indexed}
+
+
+# Tokenize a Document and find its matches.
+# Returns the document's metadata, a list of (subject, keyword, extract) for each match,
+# and stats of the seconds spent in each stage and the numbers of tokens and matches.
+# With merge, matches whose extracts overlap share one extract, covering all of them, and their subjects and
+# keywords are listed together as tuples (see merged_spans() and lexicon_columns()).
+# With original_extracts, extracts are the document's own text, rather than its normalized words joined up.
+def match_document(document, window_size=10, context_size=20, engine='indexed', merge=False, original_extracts=False):
+    memo_key = None
+    if match_memo is not None:
+        # a text matched before is not tokenized and matched again
+        memo_start = time.perf_counter()
+        memo_key = match_memo.key(document.text, window_size, context_size, merge, original_extracts)
+        remembered = match_memo.get(memo_key)
+        if remembered is not None:
+            matches, token_count, match_count = remembered
+            document_stats = {'match': time.perf_counter() - memo_start,
+                              'tokens': token_count,
+                              'matches': match_count,
+                              'memo_hits': 1}
+            return document.metadata, matches, document_stats
+
+    tokenize_start = time.perf_counter()
+    if original_extracts:
+        document_words, word_offsets = tokenize_offsets(document.text)
+    else:
+        document_words = tokenize(document.text)
+    match_start = time.perf_counter()
+    if matching_profiler is not None:
+        matching_profiler.enable()
+    spans = list(match_spans(match_engines[engine](document_words, window_size=window_size), context_size))
+    extract_spans = merged_spans(spans, max_merged_words(window_size, context_size)) if merge else spans
+    if original_extracts:
+        matches = [(subject, keyword, original_extract(document.text, word_offsets, start, end))
+                   for subject, keyword, start, end in extract_spans]
+    else:
+        matches = [(subject, keyword, ' '.join(document_words[start:end]))
+                   for subject, keyword, start, end in extract_spans]
+    if matching_profiler is not None:
+        matching_profiler.disable()
+    match_end = time.perf_counter()
+    document_stats = {'tokenize': match_start - tokenize_start,
+                      'match': match_end - match_start,
+                      'tokens': len(document_words),
+                      'matches': len(spans)}
+    if memo_key is not None:
+        match_memo.put(memo_key, (matches, len(document_words), len(spans)))
+        document_stats['memo_misses'] = 1
+    return document.metadata, matches, document_stats
+
+
+# Yield the items of iterable, adding the seconds spent getting each one to seconds[stage]
+def timed_iter(iterable, seconds, stage):
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            seconds[stage] += time.perf_counter() - start
+        yield item
+
+
+# Page at a time equivalent of match_document, for a document given as its metadata and the text of
+# each page (e.g. from PDFTranscriptDocumentSet.page_texts), with the indexed engine.
+# The words are matched as each page is extracted and tokenized, and only the words that later windows
+# and extracts need are kept, so a long document is never held in memory as one text or list of words.
+# With merge, overlapping extracts are merged, and with original_extracts, extracts taken from the text, as by
+# match_document(); the text is then kept from the first word still needed on.
+def match_document_pages(metadata, page_texts, window_size=10, context_size=20, merge=False, original_extracts=False):
+    seconds = collections.Counter()
+    start = time.perf_counter()
+    max_words = max_merged_words(window_size, context_size)
+    # the words still needed; words[0] is word number words_start of the document
+    words = []
+    words_start = 0
+    # with original_extracts, the offsets of the words still needed, and the document's text from text_start on
+    word_offsets = array.array('I')
+    text = ''
+    text_start = 0
+    # (subject, keyword, extract start, extract end) of matches waiting for the words after them; with merge,
+    # regions of matches (see new_region()), of which the last can still be merged with later matches
+    # unless region_closed
+    pending = collections.deque()
+    region_closed = True
+    matches = []
+    match_count = 0
+
+    def add_pending_matches(document_end=False):
+        # in order, until a match whose extract runs past the words read so far
+        while pending and (document_end or pending[0][3] <= words_start + len(words)):
+            if merge and len(pending) == 1 and not (region_closed or document_end):
+                break
+            subject, keyword, extract_start, extract_end = region_span(pending.popleft()) if merge else pending.popleft()
+            if original_extracts:
+                extract = original_extract(text, word_offsets, extract_start - words_start, extract_end - words_start,
+                                           text_start)
+            else:
+                extract = ' '.join(words[extract_start - words_start:extract_end - words_start])
+            matches.append((subject, keyword, extract))
+
+    def read_pages():
+        nonlocal text
+        for page_text in timed_iter(page_texts, seconds, 'extract'):
+            text += page_text
+            yield page_text
+
+    def document_words():
+        nonlocal words_start, text, text_start, region_closed
+        if original_extracts:
+            pages = tokenize_pages_offsets(read_pages())
+        else:
+            pages = zip(tokenize_pages(timed_iter(page_texts, seconds, 'extract')), itertools.repeat(None))
+        for page_words, page_offsets in timed_iter(pages, seconds, 'read'):
+            # Later matches' extracts start at most window_size + context_size words back, so a region that
+            # ends there cannot grow any more
+            if pending and pending[-1][3] <= words_start + len(words) - window_size - context_size:
+                region_closed = True
+            add_pending_matches()
+            # Later windows, and their extracts, start at most window_size + context_size words back;
+            # extracts start in the same order as their matches
+            keep_start = words_start + len(words) - window_size - context_size
+            if pending:
+                keep_start = min(keep_start, pending[0][2])
+            if keep_start > words_start:
+                del words[:keep_start - words_start]
+                if original_extracts:
+                    del word_offsets[:2 * (keep_start - words_start)]
+                    if word_offsets:
+                        text = text[word_offsets[0] - text_start:]
+                        text_start = word_offsets[0]
+                words_start = keep_start
+            words.extend(page_words)
+            if original_extracts:
+                word_offsets.extend(page_offsets)
+            yield from page_words
+
+    for span in match_spans(process_document_iter_indexed(document_words(), window_size=window_size), context_size):
+        match_count += 1
+        if not merge:
+            pending.append(span)
+        elif region_closed or not merge_span(pending[-1], span, max_words):
+            pending.append(new_region(span))
+            # the region before can no longer grow, as later matches start no earlier than this one
+            region_closed = False
+        add_pending_matches()
+    add_pending_matches(document_end=True)
+
+    elapsed = time.perf_counter() - start
+    document_stats = {'extract': seconds['extract'],
+                      'tokenize': seconds['read'] - seconds['extract'],
+                      'match': elapsed - seconds['read'],
+                      'tokens': words_start + len(words),
+                      'matches': match_count}
+    return metadata, matches, document_stats
+
+
+# Batch equivalent of match_document, for a list of Documents.
+# The batch's tokenize and match seconds are shared among its documents by number of tokens.
+def match_documents_batch(documents, window_size=10, context_size=20, merge=False, original_extracts=False):
+    # With match_memo, only the texts not matched before are tokenized and matched, each once
+    memo_keys = None
+    remembered = {}
+    new_documents = documents
+    if match_memo is not None:
+        memo_keys = [match_memo.key(document.text, window_size, context_size, merge, original_extracts)
+                     for document in documents]
+        new_documents = {}
+        for memo_key, document in zip(memo_keys, documents):
+            if memo_key in remembered or memo_key in new_documents:
+                continue
+            result = match_memo.get(memo_key)
+            if result is not None:
+                remembered[memo_key] = result
+            else:
+                new_documents[memo_key] = document
+        new_memo_keys = list(new_documents)
+        new_documents = list(new_documents.values())
+
+    tokenize_start = time.perf_counter()
+    if original_extracts:
+        batch_tokens_offsets = tokenize_batch_offsets([document.text for document in new_documents])
+        batch_words = [document_words for document_words, _ in batch_tokens_offsets]
+        batch_offsets = [word_offsets for _, word_offsets in batch_tokens_offsets]
+    else:
+        batch_words = tokenize_batch([document.text for document in new_documents])
+    match_start = time.perf_counter()
+    if matching_profiler is not None:
+        matching_profiler.enable()
+    batch_matches = []
+    batch_match_counts = []
+    for document_number, (document_words, document_matches) in enumerate(
+            zip(batch_words, process_documents_batch(batch_words, window_size))):
+        spans = match_spans(document_matches, context_size)
+        if merge:
+            spans = merged_spans(spans, max_merged_words(window_size, context_size))
+        if original_extracts:
+            document_text = new_documents[document_number].text
+            word_offsets = batch_offsets[document_number]
+            batch_matches.append([(subject, keyword, original_extract(document_text, word_offsets, start, end))
+                                  for subject, keyword, start, end in spans])
+        else:
+            batch_matches.append([(subject, keyword, ' '.join(document_words[start:end]))
+                                  for subject, keyword, start, end in spans])
+        batch_match_counts.append(len(document_matches))
+    if matching_profiler is not None:
+        matching_profiler.disable()
+    match_end = time.perf_counter()
+
+    batch_tokens = sum(map(len, batch_words))
+    new_results = []
+    for document_words, matches, match_count in zip(batch_words, batch_matches, batch_match_counts):
+        share = len(document_words) / batch_tokens if batch_tokens else 1 / len(new_documents)
+        new_results.append((matches, {'tokenize': (match_start - tokenize_start) * share,
+                                      'match': (match_end - match_start) * share,
+                                      'tokens': len(document_words),
+                                      'matches': match_count}))
+    if memo_keys is None:
+        return [(document.metadata, matches, document_stats)
+                for document, (matches, document_stats) in zip(documents, new_results)]
+
+    new_stats = {}
+    for memo_key, (matches, document_stats) in zip(new_memo_keys, new_results):
+        remembered[memo_key] = (matches, document_stats['tokens'], document_stats['matches'])
+        match_memo.put(memo_key, remembered[memo_key])
+        new_stats[memo_key] = document_stats
+    batch_results = []
+    for memo_key, document in zip(memo_keys, documents):
+        matches, token_count, match_count = remembered[memo_key]
+        if memo_key in new_stats:
+            # the first document with a new text; any others with the same text are memo hits
+            document_stats = dict(new_stats.pop(memo_key), memo_misses=1)
+        else:
+            document_stats = {'tokens': token_count, 'matches': match_count, 'memo_hits': 1}
+        batch_results.append((document.metadata, matches, document_stats))
+    return batch_results
+
+
+# Match a single tweet, converting its created date to local time
+def match_tweet(tweet, window_size=10, context_size=20, engine='indexed', merge=False, original_extracts=False):
+    tweet_info = tweet.metadata
+    date_time_obj = datetime.datetime.strptime(tweet_info['created_at'], '%a %b %d %H:%M:%S %z %Y')
+    tweet_info['created_date'] = date_time_obj.astimezone(pytz.timezone('US/Eastern')).strftime("%m/%d/%y %H:%M:%S %Z %z")
+    return match_document(tweet, window_size, context_size, engine, merge, original_extracts)
+
+
+# Batch equivalent of match_tweet, converting the created dates of all the tweets at once
+def match_tweets_batch(tweets, window_size=10, context_size=20, merge=False, original_extracts=False):
+    import pandas as pd
+
+    created_dates = pd.to_datetime(pd.Series([tweet.metadata['created_at'] for tweet in tweets], dtype=object),
+                                   format='%a %b %d %H:%M:%S %z %Y', utc=True)
+    created_dates = created_dates.dt.tz_convert('US/Eastern').dt.strftime("%m/%d/%y %H:%M:%S %Z %z")
+    for tweet, created_date in zip(tweets, created_dates):
+        tweet.metadata['created_date'] = created_date
+    return match_documents_batch(tweets, window_size, context_size, merge, original_extracts)
+
+
+# Set up a worker process with the lexicon, tokenizer and match memo of the main process; the lexicon is
+# loaded from the compiled lexicon in cache_dir, which the main process has compiled, if there is one
+def init_worker(subject_rows, keyword_rows, normalize_rows, tokenizer_name, nltk_data, cache_dir=None, memo_size=0):
+    # Ctrl-C is left to the main process, which stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    load_lexicon_compiled((subject_rows, keyword_rows, normalize_rows), cache_dir)
+    use_tokenizer(tokenizer_name, nltk_data)
+    use_match_memo(memo_size)
+
+
+# Remember the matches of up to max_entries distinct texts in match_memo; 0 turns the memo off
+def use_match_memo(max_entries):
+    global match_memo
+    match_memo = MatchMemo(max_entries) if max_entries > 0 else None
 
-    with args.normalizefile as normalize_terms_file:
-        normalize_terms_csv = csv.reader(normalize_terms_file)
-        for row in normalize_terms_csv:
-            normalize_terms[row[0]] = row[1]
 
+# Extract and match a single transcript; the unit of work for --workers
+def match_pdf_file(pdfdocset, window_size, context_size, engine, stream_pages, merge, original_extracts, pdf_filepath):
+    extract_start = time.perf_counter()
+    if stream_pages:
+        # the pages themselves are extracted as they are matched
+        page_texts = pdfdocset.page_texts(pdf_filepath)
+        extract_seconds = time.perf_counter() - extract_start
+        show_info, matches, document_stats = match_document_pages(pdfdocset.show_data(pdf_filepath), page_texts,
+                                                                   window_size, context_size, merge, original_extracts)
+        document_stats['extract'] += extract_seconds
+        return show_info, matches, document_stats
+    pdfdoc = pdfdocset.document(pdf_filepath)
+    extract_seconds = time.perf_counter() - extract_start
+    show_info, matches, document_stats = match_document(pdfdoc, window_size, context_size, engine, merge,
+                                                        original_extracts)
+    document_stats['extract'] = extract_seconds
+    return show_info, matches, document_stats
+
+
+# Read and match the tweets or emails of one SFM or email extract file, yielding the results of each document,
+# as match_document(). Documents the manifest (if given) records as processed with lexicon_version are skipped.
+def extract_file_results(mode, window_size, context_size, engine, batch, merge, original_extracts, chunk_size,
+                         manifest_filepath, lexicon_version, table_filepath):
+    manifest = None
+    if manifest_filepath is not None:
+        manifest = ProcessedManifest(manifest_filepath, lexicon_version, read_only=True)
+    document_key = tweet_document_key if mode == 'tweets' else email_document_key
+
+    def is_new(document):
+        return manifest is None or not manifest.is_processed(document_key(document.metadata))
+
+    if mode == 'tweets':
+        docset = SFMExtractDocumentSet(table_filepath, chunk_size=chunk_size)
+        if batch:
+            results = itertools.chain.from_iterable(
+                match_tweets_batch(list(filter(is_new, tweets)), window_size, context_size, merge, original_extracts)
+                for tweets in docset.document_chunks())
+        else:
+            results = (match_tweet(tweet, window_size, context_size, engine, merge, original_extracts)
+                       for tweet in filter(is_new, docset))
+    else:
+        docset = EmailExtractDocumentSet(table_filepath, chunk_size=chunk_size)
+        results = (match_document(email, window_size, context_size, engine, merge, original_extracts)
+                   for email in filter(is_new, docset))
+    try:
+        yield from results
+    finally:
+        if manifest is not None:
+            manifest.close()
+
+
+# All the results of one extract file, from extract_file_results(); the unit of work for --workers in tweets
+# and email mode
+def match_extract_file(*file_args):
+    return list(extract_file_results(*file_args))
+
+
+# Version of the lexicon and matching settings, recorded with each processed document
+def lexicon_version(subject_rows, keyword_rows, normalize_rows, window_size, context_size, merge_extracts=False,
+                    original_extracts=False):
+    settings = [subject_rows, keyword_rows, normalize_rows, window_size, context_size, MATCHING_RULES]
+    # options are only added when set, so that manifests written before they existed still apply
+    if merge_extracts:
+        settings.append('merge_extracts')
+    if original_extracts:
+        settings.append('original_extracts')
+    lexicon_json = json.dumps(settings)
+    return hashlib.sha256(lexicon_json.encode('utf-8')).hexdigest()[:16]
+
+
+# Keys identifying each kind of document in the manifest
+def pdf_document_key(pdf_filepath):
+    return 'pdf:{}:{}'.format(os.path.abspath(pdf_filepath), file_sha256(pdf_filepath))
+
+
+def tweet_document_key(tweet_info):
+    return 'tweet:' + tweet_info['id'].strip("'")
+
+
+def email_document_key(email_info):
+    return 'email:' + '|'.join((email_info['Date'], email_info['From'], email_info['Subject'], email_info['Message hash']))
+
+
+# The date a document is counted under in the corpus statistics, as YYYY-MM-DD: a transcript's show date,
+# a tweet's created date (in local time, as in the extracts), or an email's date, if it can be read
+def document_date(mode, info):
+    if mode == 'pdf':
+        return iso_date(mode, info['show_date'])
+    if mode == 'tweets':
+        return iso_date(mode, info['created_date'][:8])
+    return iso_date(mode, str(info['Date']).strip())
+
+
+# The same few dates come up for document after document, so each is only read once
+@functools.lru_cache(maxsize=4096)
+def iso_date(mode, date_text):
+    if mode == 'pdf':
+        month, day, year = date_text.split('/')
+        return '-'.join((year, month, day))
+    if mode == 'tweets':
+        return datetime.datetime.strptime(date_text, '%m/%d/%y').date().isoformat()
+    try:
+        return datetime.datetime.fromisoformat(date_text).date().isoformat()
+    except ValueError:
+        pass
+    try:
+        return email.utils.parsedate_to_datetime(date_text).date().isoformat()
+    except (TypeError, ValueError):
+        return date_text
+
+
+# Process the transcripts, or the SFM or email extract file, at transcript_path in args.mode, adding their
+# extracts to extracts-<mode>; the work of a run, and of each file landing in the inbox in --watch mode.
+# lexicon_rows are the subject, keyword and normalize terms rows, as loaded with load_lexicon().
+# pool, if given, is a pool of workers started with start_worker_pool(), run_profile a RunProfile to add to,
+# and corpus_stats a CorpusStats to count the documents written in.
+# Returns the RunProfile.
+def process_input(args, transcript_path, lexicon_rows, text_cache, pool=None, run_profile=None, corpus_stats=None):
     pdfdocset = None
     headers = []
     if args.mode == 'pdf':
         if args.verbose:
             print("Getting pdfdocset...")
-        pdfdocset = PDFTranscriptDocumentSet(args.transcript)
+        pdfdocset = PDFTranscriptDocumentSet(transcript_path, text_cache=text_cache, extractor=args.pdf_extractor)
         if args.verbose:
             print("                   ...complete")
         headers = ['extract_date', 'file', 'show_date', 'show_id', 'show_name',
@@ -136,11 +1108,12 @@ if __name__ == '__main__':
                    'Code (N/1-6)', 'A/B', 'Foreign/Domestic', 'Notes', 'Feedback',
                    'extract',
                    'Code (N/1-6)', 'A/B', 'Foreign/Domestic', 'Notes', 'Feedback']
-        extractfilename = 'extracts-pdf.csv'
+        extract_basename = 'extracts-pdf'
+        index_columns = ['show_name', 'show_date', 'subject_code', 'keyword_code']
     if args.mode == 'tweets':
         if args.verbose:
             print("Getting tweetdocset...")
-        tweetdocset = SFMExtractDocumentSet(args.transcript)
+        tweetdocset = SFMExtractDocumentSet(transcript_path, chunk_size=args.batch_size)
         if args.verbose:
             print("                   ...complete")
         headers = ['extract_date', 'tweet_id', 'created_date', 'user_screen_name', 'tweet_url', 'tweet_type',
@@ -148,11 +1121,12 @@ if __name__ == '__main__':
                    'Code (N, or 1-6)', 'A/B', 'Foreign/Domestic', 'Notes', 'Feedback',
                    'text',
                    'Code (N, or 1-6)', 'A/B', 'Foreign/Domestic', 'Notes', 'Feedback']
-        extractfilename = 'extracts-tweets.csv'
+        extract_basename = 'extracts-tweets'
+        index_columns = ['user_screen_name', 'created_date', 'subject_code', 'keyword_code']
     if args.mode == 'email':
         if args.verbose:
             print("Getting emaildocset...")
-        emaildocset = EmailExtractDocumentSet(args.transcript)
+        emaildocset = EmailExtractDocumentSet(transcript_path, chunk_size=args.batch_size)
         if args.verbose:
             print("                   ...complete")
         headers = ['extract_date', 'email_date', 'email_from', 'email_subject',
@@ -160,143 +1134,416 @@ if __name__ == '__main__':
                    'Code (N, or 1-6)', 'A/B', 'Foreign/Domestic', 'Notes', 'Feedback',
                    'text',
                    'Code (N, or 1-6)', 'A/B', 'Foreign/Domestic', 'Notes', 'Feedback']
-        extractfilename = 'extracts-email.csv'
+        extract_basename = 'extracts-email'
+        index_columns = ['email_from', 'email_date', 'subject_code', 'keyword_code']
 
-    # If extracts.csv exists, append to it rather than overwriting it.
-    if os.path.exists(extractfilename):
-        append_extracts = True
-        file_mode = 'a+'
-    else:
-        append_extracts = False
-        file_mode = 'w'
+    # One extract date for every row written in this run
+    run_started = datetime.datetime.now(tz=pytz.timezone(TIME_ZONE))
+    run_extract_date = run_started.strftime("%m/%d/%y %H:%M:%S %Z%z")
+    extract_sink = open_extract_sink(args.output_format, extract_basename, headers, index_columns,
+                                     run_id=run_started.strftime('%Y%m%d-%H%M%S-%f'))
+
+    # The manifest records which documents are already in the extracts, so they can be skipped.
+    # It describes the extracts file, so it starts over along with it.
+    manifestfilename = extract_basename + ('' if args.output_format == 'csv' else '-' + args.output_format) + '-manifest.sqlite'
+    if not extract_sink.appending and os.path.exists(manifestfilename):
+        os.remove(manifestfilename)
+    run_lexicon_version = lexicon_version(*lexicon_rows, args.window, args.context, args.merge_extracts,
+                                          args.original_extracts)
+
+    if run_profile is None:
+        # Documents are only listed individually in the profile for transcripts, to find slow shows
+        run_profile = RunProfile(args.mode, keep_documents=(args.mode == 'pdf'))
 
     if args.mode == 'pdf':
-        with open('extracts-pdf.csv', file_mode) as extract_file:
-            # If the file was previously saved using Excel, it will be lacking a final \n character.
-            # So, we need to check if it's missing; if so, add it so that appending starts on a new line.
-            if append_extracts:
-                fix_newline(extract_file)
-            extract_csv = csv.writer(extract_file)
-            if not append_extracts:
-                extract_csv.writerow(headers)
-
-            for pdfdoc in pdfdocset:
-                show_info = pdfdoc.metadata
-
-                m_transcript_filepath = show_info['show_file_path']
+        with extract_sink:
+            manifest = ProcessedManifest(manifestfilename, run_lexicon_version, output_file=extract_sink, commit_every=1)
+            # Only new or changed transcripts need processing
+            pdf_keys = {}
+            for pdf_filepath in pdfdocset.transcript_filepaths:
+                pdf_key = pdf_document_key(pdf_filepath)
+                if args.reprocess or not manifest.is_processed(pdf_key):
+                    pdf_keys[pdf_filepath] = pdf_key
+                elif args.verbose:
+                    print('Skipping {}, already processed'.format(pdf_filepath))
+
+            match_pdf = functools.partial(match_pdf_file, pdfdocset, args.window, args.context, args.engine,
+                                          args.stream_pages, args.merge_extracts, args.original_extracts)
+            own_pool = pool is None and args.workers > 1
+            if own_pool:
+                pool = start_worker_pool(args, lexicon_rows)
+            if pool is not None:
+                # imap hands back results in file order, whichever worker finishes first
+                pdf_results = pool.imap(match_pdf, pdf_keys)
+            else:
+                pdf_results = map(match_pdf, pdf_keys)
+
+            for (m_transcript_filepath, pdf_key), (show_info, pdf_matches, document_stats) in zip(pdf_keys.items(),
+                                                                                                     pdf_results):
                 print('Processing {}'.format(m_transcript_filepath))
-                m_transcript_text = pdfdoc.text
-                m_transcript_words = tokenize(m_transcript_text)
-                for m_subject, m_subject_pos, m_keyword, m_keyword_pos in process_document_iter(m_transcript_words,
-                                                                                                window_size=args.window):
-                    extract_date = datetime.datetime.now(tz=pytz.timezone(TIME_ZONE)).strftime("%m/%d/%y %H:%M:%S %Z%z")
-
-                    extract = ' '.join(
-                        context(m_transcript_words, min(m_subject_pos, m_keyword_pos),
-                                max(m_subject_pos, m_keyword_pos),
-                                context_size=args.context))
-
-                    extract_csv.writerow([extract_date,
-                                          m_transcript_filepath,
-                                          show_info['show_date'],
-                                          show_info['show_id'],
-                                          show_info['show_name'],
-                                          m_subject,
-                                          subject_map[m_subject],
-                                          m_keyword,
-                                          keyword_map[m_keyword],
-                                          keyword_id[m_keyword],
-                                          '', '', '', '', '',
-                                          extract])
-    if args.mode == 'tweets':
-        with open('extracts-tweets.csv', file_mode) as extract_file:
-            # If the file was previously saved using Excel, it will be lacking a final \n character.
-            # So, we need to check if it's missing; if so, add it so that appending starts on a new line.
-            if append_extracts:
-                fix_newline(extract_file)
-            extract_csv = csv.writer(extract_file)
-            if not append_extracts:
-                extract_csv.writerow(headers)
-
-            for tweet in tweetdocset:
-                if args.verbose:
-                    print('Checking a tweet')
-                tweet_info = tweet.metadata
-
-                # Convert created_date to local time zone
-                date_time_obj = datetime.datetime.strptime(tweet_info['created_at'], '%a %b %d %H:%M:%S %z %Y')
-                tweet_info['created_date'] = date_time_obj.astimezone(pytz.timezone('US/Eastern')).strftime("%m/%d/%y %H:%M:%S %Z %z")
-
-                #m_tweet_account = tweet_info['user_screen_name']
-                # print('Processing {}'.format(m_transcript_filepath))
-                m_transcript_text = tweet.text
-                m_transcript_words = tokenize(m_transcript_text)
-                for m_subject, m_subject_pos, m_keyword, m_keyword_pos in process_document_iter(m_transcript_words,
-                                                                                                window_size=args.window):
+                write_start = time.perf_counter()
+                for m_subject, m_keyword, extract in pdf_matches:
+                    extract_sink.write([run_extract_date,
+                                        m_transcript_filepath,
+                                        show_info['show_date'],
+                                        show_info['show_id'],
+                                        show_info['show_name'],
+                                        *lexicon_columns(m_subject, m_keyword),
+                                        '', '', '', '', '',
+                                        extract])
+                manifest.mark_processed(pdf_key)
+                document_stats['write'] = time.perf_counter() - write_start
+                document_stats['rows'] = len(pdf_matches)
+                run_profile.add_document(m_transcript_filepath, document_stats)
+                if corpus_stats is not None:
+                    corpus_stats.add_document(m_transcript_filepath, document_date(args.mode, show_info),
+                                              document_stats['tokens'], document_stats['matches'],
+                                              [code_pair for m_subject, m_keyword, _ in pdf_matches
+                                               for code_pair in match_code_pairs(m_subject, m_keyword)],
+                                              show=show_info['show_name'])
+            if own_pool:
+                pool.close()
+                pool.join()
+            manifest.close()
+    if args.mode in ('tweets', 'email'):
+        docset = tweetdocset if args.mode == 'tweets' else emaildocset
+        document_key = tweet_document_key if args.mode == 'tweets' else email_document_key
+        with extract_sink:
+            manifest = ProcessedManifest(manifestfilename, run_lexicon_version, output_file=extract_sink,
+                                         commit_every=args.batch_size)
+            # Documents already processed are skipped as each file is read, looking them up in the manifest
+            file_args = (args.mode, args.window, args.context, args.engine, args.batch, args.merge_extracts,
+                         args.original_extracts, args.batch_size, None if args.reprocess else manifestfilename, run_lexicon_version)
+            own_pool = pool is None and args.workers > 1 and len(docset.filepaths) > 1
+            if own_pool:
+                pool = start_worker_pool(args, lexicon_rows)
+            if pool is not None:
+                # imap hands back each file's results in file order, whichever worker finishes first
+                file_results = pool.imap(functools.partial(match_extract_file, *file_args), docset.filepaths)
+            else:
+                # one file after another, each read and matched as it is written
+                file_results = map(functools.partial(extract_file_results, *file_args), docset.filepaths)
+
+            for file_number, (table_filepath, results) in enumerate(zip(docset.filepaths, file_results), 1):
+                file_documents = 0
+                file_rows = 0
+                for info, document_matches, document_stats in results:
+                    # e.g. a tweet in more than one file, found by another worker's file earlier in this run
+                    if not args.reprocess and manifest.is_processed(document_key(info)):
+                        continue
                     if args.verbose:
-                        print('    Found a match')
-                    extract_date = datetime.datetime.now(tz=pytz.timezone(TIME_ZONE)).strftime("%m/%d/%y %H:%M:%S %Z%z")
-
-                    extract = ' '.join(
-                        context(m_transcript_words, min(m_subject_pos, m_keyword_pos),
-                                max(m_subject_pos, m_keyword_pos),
-                                context_size=args.context))
-                    extract_csv.writerow([extract_date,
-                                          tweet_info['id'],
-                                          tweet_info['created_date'],
-                                          tweet_info['user_screen_name'],
-                                          tweet_info['tweet_url'],
-                                          tweet_info['tweet_type'],
-                                          m_subject,
-                                          subject_map[m_subject],
-                                          m_keyword,
-                                          keyword_map[m_keyword],
-                                          keyword_id[m_keyword],
-                                          '', '', '', '', '',
-                                          extract])
+                        if args.mode == 'tweets':
+                            print('Checking a tweet')
+                        else:
+                            print('Checking an email dated ' + str(info['Date']))
+                    write_start = time.perf_counter()
 
-    if args.mode == 'email':
-        with open('extracts-email.csv', file_mode) as extract_file:
-            # If the file was previously saved using Excel, it will be lacking a final \n character.
-            # So, we need to check if it's missing; if so, add it so that appending starts on a new line.
-            if append_extracts:
-                fix_newline(extract_file)
-            extract_csv = csv.writer(extract_file)
-            if not append_extracts:
-                extract_csv.writerow(headers)
-
-            for email in emaildocset:
-                if args.verbose:
-                    print('Checking an email dated ' + str(email.metadata['Date']))
-                email_info = email.metadata
-                m_transcript_text = email.text
-
-#                if args.verbose:
-#                    print('Email metadata is:')
-#                    print(email.metadata)
-#                    print('Email text is:')
-#                    print(email.text)
-                email_info = email.metadata
-                m_transcript_words = tokenize(m_transcript_text)
-                for m_subject, m_subject_pos, m_keyword, m_keyword_pos in process_document_iter(m_transcript_words,
-                                                                                                window_size=args.window):
-#                    if args.verbose:
-#                        print('    Found a match')
-                    extract_date = datetime.datetime.now(tz=pytz.timezone(TIME_ZONE)).strftime("%m/%d/%y %H:%M:%S %Z%z")
-
-                    extract = ' '.join(
-                        context(m_transcript_words, min(m_subject_pos, m_keyword_pos),
-                                max(m_subject_pos, m_keyword_pos),
-                                context_size=args.context))
-                    extract_csv.writerow([extract_date,
-                                          email_info['Date'],
-                                          email_info['From'],
-                                          email_info['Subject'],
-                                          m_subject,
-                                          subject_map[m_subject],
-                                          m_keyword,
-                                          keyword_map[m_keyword],
-                                          keyword_id[m_keyword],
-                                          '', '', '', '', '',
-                                          extract])
+                    for m_subject, m_keyword, extract in document_matches:
+                        if args.mode == 'tweets':
+                            if args.verbose:
+                                print('    Found a match')
+                            extract_sink.write([run_extract_date,
+                                                info['id'],
+                                                info['created_date'],
+                                                info['user_screen_name'],
+                                                info['tweet_url'],
+                                                info['tweet_type'],
+                                                *lexicon_columns(m_subject, m_keyword),
+                                                '', '', '', '', '',
+                                                extract])
+                        else:
+                            extract_sink.write([run_extract_date,
+                                                info['Date'],
+                                                info['From'],
+                                                info['Subject'],
+                                                *lexicon_columns(m_subject, m_keyword),
+                                                '', '', '', '', '',
+                                                extract])
+                    manifest.mark_processed(document_key(info))
+                    document_stats['write'] = time.perf_counter() - write_start
+                    document_stats['rows'] = len(document_matches)
+                    run_profile.add_document(info['id'] if args.mode == 'tweets' else document_key(info), document_stats)
+                    if corpus_stats is not None:
+                        corpus_stats.add_document(info['id'] if args.mode == 'tweets' else document_key(info),
+                                                  document_date(args.mode, info),
+                                                  document_stats['tokens'], document_stats['matches'],
+                                                  [code_pair for m_subject, m_keyword, _ in document_matches
+                                                   for code_pair in match_code_pairs(m_subject, m_keyword)])
+                    file_documents += 1
+                    file_rows += len(document_matches)
+                print('Processed {} ({} of {}): {} new {}, {} rows'.format(
+                    table_filepath, file_number, len(docset.filepaths), file_documents,
+                    'tweets' if args.mode == 'tweets' else 'emails', file_rows))
+            if own_pool:
+                pool.close()
+                pool.join()
+            manifest.close()
+    return run_profile
+
+
+# Workers set up the lexicon and tokenizer themselves, so this also works where processes are spawned rather than forked
+def start_worker_pool(args, lexicon_rows):
+    return multiprocessing.Pool(args.workers, initializer=init_worker,
+                                initargs=(*lexicon_rows, args.tokenizer, args.nltk_data, lexicon_cache_dir(args),
+                                          match_memo_size(args)))
+
+
+# The match memo is only used for tweets and emails, which repeat each other's texts; transcripts do not,
+# and remembering their matches would only hold on to them
+def match_memo_size(args):
+    return args.memo_size if args.mode in ('tweets', 'email') else 0
+
+
+# The CorpusStats counting the documents written, with --stats; documents are only counted individually
+# for transcripts, as there are few of them
+def new_corpus_stats(args):
+    return CorpusStats(args.mode, keep_documents=(args.mode == 'pdf')) if args.stats else None
+
+
+# Where the lexicon is compiled to: the cache directory, unless the cache is not used
+def lexicon_cache_dir(args):
+    return None if args.no_cache else args.cache_dir
+
+
+# The rows of the subjects, keywords and normalize terms CSV files
+def read_lexicon_rows(lexicon_filepaths):
+    lexicon_rows = []
+    for lexicon_filepath in lexicon_filepaths:
+        with open(lexicon_filepath, newline='') as lexicon_file:
+            lexicon_rows.append(list(csv.reader(lexicon_file)))
+    return tuple(lexicon_rows)
+
+
+def lexicon_mtimes(lexicon_filepaths):
+    return [os.stat(lexicon_filepath).st_mtime_ns for lexicon_filepath in lexicon_filepaths]
+
+
+# Files of each mode picked up from the --watch inbox
+WATCH_EXTENSIONS = {'pdf': ('.pdf',),
+                    'tweets': ('.xlsx', '.csv', '.json', '.jsonl'),
+                    'email': ('.xlsx', '.csv')}
+
+
+# Move a processed file into directory, keeping any earlier file of the same name
+def move_into(filepath, directory):
+    os.makedirs(directory, exist_ok=True)
+    target = os.path.join(directory, os.path.basename(filepath))
+    if os.path.exists(target):
+        stem, extension = os.path.splitext(target)
+        target = '{}-{}{}'.format(stem, time.strftime('%Y%m%d-%H%M%S'), extension)
+    shutil.move(filepath, target)
+    return target
+
+
+# Keep running, processing each file that lands in inbox as a run given that file would, with the lexicon,
+# tokenizer and worker pool set up once. Processed files are moved to args.done_dir, and files that fail to
+# <inbox>/failed. A file has landed once its size and modification time stay the same from one poll to the next,
+# so that files still being copied in are left alone. The lexicon files are reloaded whenever they change.
+# With --stats, the corpus statistics of all the files processed so far are written after each one.
+# Stops on Ctrl-C.
+def watch_inbox(args, inbox, lexicon_filepaths, lexicon_rows, text_cache):
+    done_dir = args.done_dir or os.path.join(inbox, 'done')
+    failed_dir = os.path.join(inbox, 'failed')
+    # Import what processing the first file needs now, rather than when it lands
+    importlib.import_module('pdftext' if args.mode == 'pdf' else 'openpyxl')
+    loaded_mtimes = lexicon_mtimes(lexicon_filepaths)
+    pool = start_worker_pool(args, lexicon_rows) if args.mode == 'pdf' and args.workers > 1 else None
+    corpus_stats = new_corpus_stats(args)
+    seen = {}
+    print('Watching {} for {} files'.format(inbox, args.mode))
+    try:
+        while True:
+            try:
+                current_mtimes = lexicon_mtimes(lexicon_filepaths)
+            except OSError:
+                # e.g. a lexicon file being replaced; look again at the next poll
+                current_mtimes = loaded_mtimes
+            if current_mtimes != loaded_mtimes:
+                loaded_mtimes = current_mtimes
+                try:
+                    new_lexicon_rows = read_lexicon_rows(lexicon_filepaths)
+                    load_lexicon_compiled(new_lexicon_rows, lexicon_cache_dir(args))
+                except Exception as error:
+                    print('Keeping the lexicon loaded before, as the changed lexicon files could not be loaded: {}'.format(error))
+                    load_lexicon(*lexicon_rows)
+                else:
+                    lexicon_rows = new_lexicon_rows
+                    print('Reloaded the lexicon')
+                    warn_shadowed_entries()
+                    if pool is not None:
+                        pool.close()
+                        pool.join()
+                        pool = start_worker_pool(args, lexicon_rows)
+
+            landed = []
+            polled = {}
+            for entry in sorted(os.scandir(inbox), key=lambda entry: entry.name):
+                if not entry.is_file() or not entry.name.lower().endswith(WATCH_EXTENSIONS[args.mode]):
+                    continue
+                file_stat = entry.stat()
+                polled[entry.path] = (file_stat.st_size, file_stat.st_mtime_ns)
+                if seen.get(entry.path) == polled[entry.path]:
+                    landed.append(entry.path)
+            seen = polled
+
+            for filepath in landed:
+                # Documents are only listed individually in the profile for transcripts, to find slow shows
+                run_profile = RunProfile(args.mode, keep_documents=(args.mode == 'pdf'))
+                try:
+                    process_input(args, filepath, lexicon_rows, text_cache, pool=pool, run_profile=run_profile,
+                                  corpus_stats=corpus_stats)
+                except InputFileError as error:
+                    # e.g. an extract file without the columns needed; no traceback needed to say why
+                    print(error)
+                    print('Moved {} to {}'.format(filepath, move_into(filepath, failed_dir)))
+                except Exception:
+                    traceback.print_exc()
+                    print('Moved {} to {}'.format(filepath, move_into(filepath, failed_dir)))
+                else:
+                    print('Moved {} to {}'.format(filepath, move_into(filepath, done_dir)))
+                    if args.verbose:
+                        print(run_profile.report())
+                    if args.profile:
+                        run_profile.write(args.profile)
+                if corpus_stats is not None:
+                    corpus_stats.write(args.stats)
+                del seen[filepath]
+            if not landed:
+                time.sleep(args.poll_interval)
+    except KeyboardInterrupt:
+        print('Stopped watching {}'.format(inbox))
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--window', help='number of words that subject and keyword must be within (default = 5)', type=int,
+                        default=10)
+    parser.add_argument('--context', help='number of words before and after subject and keyword to extract (default = 20)', type=int,
+                        default=20)
+    parser.add_argument('--subjectfile', help='subject list file (default = subjects.csv)', type=argparse.FileType('r'),
+                        default='subjects.csv')
+    parser.add_argument('--keywordfile', help='keyword list file (default = keywords.csv)', type=argparse.FileType('r'),
+                        default='keywords.csv')
+    parser.add_argument('--normalizefile', help='normalize terms file (default = normalize_terms.csv)', type=argparse.FileType('r'),
+                        default='normalize_terms.csv')
+    parser.add_argument('--mode', help='Mode: pdf or tweets or email', type=str,
+                        default='pdf')
+    parser.add_argument('--engine', help='matching engine: indexed (single pass, default) or scan (original window scan)',
+                        choices=sorted(match_engines), default='indexed')
+    parser.add_argument('--tokenizer', help='word tokenizer: nltk (nltk\'s word_tokenize, default) or regex (faster to start, '
+                                            'needs no nltk data)', choices=['nltk', 'regex'], default='nltk')
+    parser.add_argument('--nltk-data', help='directory containing nltk data (the punkt tokenizer)', type=str)
+    parser.add_argument('--workers', help='number of processes extracting and matching transcripts, or reading and matching '
+                                           'SFM or email extract files, in parallel (default = 1)',
+                        type=int, default=1)
+    parser.add_argument('--batch', help='in tweets mode, tokenize and match tweets a chunk at a time', action='store_true')
+    parser.add_argument('--batch-size', help='number of tweets per chunk read, and matched with --batch (default = 1000)',
+                        type=int, default=1000)
+    parser.add_argument('--pdf-extractor', help='PDF text extractor: fast (default) or pdfminer (pdfminer\'s TextConverter, '
+                                                'slower, for the same text)', choices=['fast', 'pdfminer'], default='fast')
+    parser.add_argument('--stream-pages', help='in pdf mode, extract, tokenize and match each transcript a page at a time, '
+                                               'to use less memory on long transcripts', action='store_true')
+    parser.add_argument('--merge-extracts', help='write one extract for each passage of overlapping extracts, listing all the '
+                                                 'subjects and keywords matched in it', action='store_true')
+    parser.add_argument('--original-extracts', help='take extracts from the text of each document as it is, with its case and '
+                                                    'punctuation, rather than joining up its normalized words', action='store_true')
+    parser.add_argument('--memo-size', help='in tweets and email mode, number of distinct texts whose matches are remembered, so that '
+                                            'repeated texts (e.g. retweets) are only matched once; 0 turns this off (default = 50000)',
+                        type=int, default=50000)
+    parser.add_argument('--cache-dir', help='directory caching text extracted from PDFs (default = .vopd-cache)', type=str,
+                        default='.vopd-cache')
+    parser.add_argument('--cache-size', help='maximum size of the PDF text cache in MB (default = 512)', type=int,
+                        default=512)
+    parser.add_argument('--no-cache', help='always extract text from PDFs, without using the cache',
+                        action='store_true')
+    parser.add_argument('--clear-cache', help='empty the PDF text cache before processing (or just empty it, if no transcript is given)',
+                        action='store_true')
+    parser.add_argument('--compile-lexicon', help='compile the subject, keyword and normalize terms lists into the cache directory '
+                                                  '(as is done whenever they change) before processing (or just compile them, '
+                                                  'if no transcript is given)', action='store_true')
+    parser.add_argument('--output-format', help='extracts file format: csv (default), sqlite or parquet (needs pyarrow)',
+                        choices=sorted(OUTPUT_FORMATS), default='csv')
+    parser.add_argument('--reprocess', help='process all documents, including those the manifest records as already processed',
+                        action='store_true')
+    parser.add_argument('--profile', help='write a JSON summary of the time spent in each stage, and throughput, to this file',
+                        type=str)
+    parser.add_argument('--stats', help='write a JSON summary of the documents written to this file: tokens, matches and matches '
+                                        'per 10k words, severity histograms and subject by keyword code counts, in total, '
+                                        'by date and by show', type=str)
+    parser.add_argument('--profile-matching', help='write cProfile stats of the matching stage to this file (in-process work only)',
+                        type=str)
+    parser.add_argument('--watch', help='keep running, processing each file (of this mode) that lands in this inbox directory '
+                                        'in place of transcript', type=str, metavar='INBOX')
+    parser.add_argument('--done-dir', help='with --watch, directory processed files are moved to (default = INBOX/done)',
+                        type=str)
+    parser.add_argument('--poll-interval', help='with --watch, seconds between looks at the inbox (default = 2)',
+                        type=float, default=2.0)
+    parser.add_argument("--verbose", help="increase output verbosity",
+                        action="store_true")
+    parser.add_argument('transcript', help='filepath to transcript pdf or directory, or to SFM extract Excel file',
+                        nargs='?')
+
+    args = parser.parse_args()
+
+    text_cache = None
+    if not args.no_cache:
+        text_cache = ExtractedTextCache(args.cache_dir, args.cache_size * 1024 * 1024)
+    if args.clear_cache:
+        ExtractedTextCache(args.cache_dir, 0).clear()
+        if args.transcript is None and args.watch is None and not args.compile_lexicon:
+            sys.exit(0)
+    if args.compile_lexicon and args.no_cache:
+        parser.error('--compile-lexicon compiles the lexicon into the cache directory, so cannot be used with --no-cache')
+    if args.watch is not None:
+        if args.transcript is not None:
+            parser.error('give either a transcript or --watch, not both')
+        if not os.path.isdir(args.watch):
+            parser.error('--watch: {} is not a directory'.format(args.watch))
+    elif args.transcript is None and not args.compile_lexicon:
+        parser.error('the following arguments are required: transcript')
+    if args.stream_pages and args.engine != 'indexed':
+        parser.error('--stream-pages needs the indexed engine')
+
+    # Read subjects, keywords, and normalize_terms
+    with args.subjectfile as subjects_file:
+        subject_rows = list(csv.reader(subjects_file))
+    with args.keywordfile as keywords_file:
+        keyword_rows = list(csv.reader(keywords_file))
+    with args.normalizefile as normalize_terms_file:
+        normalize_rows = list(csv.reader(normalize_terms_file))
+    lexicon_rows = (subject_rows, keyword_rows, normalize_rows)
+    load_lexicon_compiled(lexicon_rows, lexicon_cache_dir(args), recompile=args.compile_lexicon)
+    warn_shadowed_entries()
+    if args.compile_lexicon and args.transcript is None and args.watch is None:
+        sys.exit(0)
+    use_tokenizer(args.tokenizer, args.nltk_data)
+    use_match_memo(match_memo_size(args))
+    if args.profile_matching:
+        matching_profiler = cProfile.Profile()
+
+    if args.watch is not None:
+        lexicon_filepaths = [args.subjectfile.name, args.keywordfile.name, args.normalizefile.name]
+        watch_inbox(args, args.watch, lexicon_filepaths, lexicon_rows, text_cache)
+        if matching_profiler is not None:
+            matching_profiler.dump_stats(args.profile_matching)
+        sys.exit(0)
+
+    corpus_stats = new_corpus_stats(args)
+    try:
+        run_profile = process_input(args, args.transcript, lexicon_rows, text_cache, corpus_stats=corpus_stats)
+    except InputFileError as error:
+        print(error)
+        sys.exit(1)
 
+    if args.profile or args.verbose:
+        print(run_profile.report())
+    if args.profile:
+        run_profile.write(args.profile)
+    if corpus_stats is not None:
+        corpus_stats.write(args.stats)
+    if matching_profiler is not None:
+        matching_profiler.dump_stats(args.profile_matching)